@@ -0,0 +1,56 @@
+"""contacts archive"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191000"
+down_revision = "202610190900"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "contacts_archive",
+        sa.Column("id", sa.Integer(), nullable=False, primary_key=True),
+        sa.Column("lead_id", sa.Integer(), nullable=False),
+        sa.Column("source_id", sa.Integer(), nullable=False),
+        sa.Column("operator_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=False, server_default=sa.text("0")),
+        sa.Column("message", sa.Text(), nullable=True),
+        sa.Column(
+            "archived_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["lead_id"],
+            ["leads.id"],
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["source_id"],
+            ["sources.id"],
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["operator_id"],
+            ["operators.id"],
+            ondelete="SET NULL",
+        ),
+    )
+    op.create_index(
+        "ix_contacts_archive_lead_id", "contacts_archive", ["lead_id"], unique=False
+    )
+    op.create_index(
+        "ix_contacts_archive_source_id", "contacts_archive", ["source_id"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contacts_archive_source_id", table_name="contacts_archive")
+    op.drop_index("ix_contacts_archive_lead_id", table_name="contacts_archive")
+    op.drop_table("contacts_archive")
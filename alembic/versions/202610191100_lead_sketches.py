@@ -0,0 +1,38 @@
+"""lead sketches"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191100"
+down_revision = "202610191000"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "lead_sketches",
+        sa.Column("id", sa.Integer(), nullable=False, primary_key=True),
+        sa.Column("source_id", sa.Integer(), nullable=False),
+        sa.Column("operator_id", sa.Integer(), nullable=True),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("registers", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["source_id"],
+            ["sources.id"],
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["operator_id"],
+            ["operators.id"],
+            ondelete="CASCADE",
+        ),
+        sa.UniqueConstraint("source_id", "operator_id", "day", name="uix_lead_sketch"),
+    )
+    op.create_index("ix_lead_sketches_day", "lead_sketches", ["day"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_lead_sketches_day", table_name="lead_sketches")
+    op.drop_table("lead_sketches")
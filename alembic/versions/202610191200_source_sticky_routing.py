@@ -0,0 +1,24 @@
+"""source sticky routing"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191200"
+down_revision = "202610191100"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "sticky_routing", sa.Boolean(), nullable=False, server_default=sa.text("0")
+            )
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.drop_column("sticky_routing")
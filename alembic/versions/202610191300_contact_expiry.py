@@ -0,0 +1,29 @@
+"""contact inactivity expiry"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191300"
+down_revision = "202610191200"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.add_column(
+            sa.Column("inactivity_timeout_minutes", sa.Integer(), nullable=True)
+        )
+    op.create_index(
+        "ix_contacts_is_active_created_at",
+        "contacts",
+        ["is_active", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contacts_is_active_created_at", table_name="contacts")
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.drop_column("inactivity_timeout_minutes")
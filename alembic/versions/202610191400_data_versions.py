@@ -0,0 +1,22 @@
+"""data versions"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191400"
+down_revision = "202610191300"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "data_versions",
+        sa.Column("entity", sa.String(length=50), nullable=False, primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False, server_default=sa.text("0")),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("data_versions")
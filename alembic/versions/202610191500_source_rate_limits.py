@@ -0,0 +1,31 @@
+"""source rate limits"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191500"
+down_revision = "202610191400"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.add_column(sa.Column("rate_limit", sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column("rate_burst", sa.Integer(), nullable=True))
+        batch_op.add_column(
+            sa.Column(
+                "overflow_mode",
+                sa.String(length=10),
+                nullable=False,
+                server_default="reject",
+            )
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.drop_column("overflow_mode")
+        batch_op.drop_column("rate_burst")
+        batch_op.drop_column("rate_limit")
@@ -0,0 +1,37 @@
+"""source smooth round-robin state"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191600"
+down_revision = "202610191500"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "distribution_mode",
+                sa.String(length=10),
+                nullable=False,
+                server_default="random",
+            )
+        )
+    op.create_table(
+        "source_wrr_state",
+        sa.Column("source_id", sa.Integer(), nullable=False),
+        sa.Column("operator_id", sa.Integer(), nullable=False),
+        sa.Column("current", sa.Integer(), nullable=False, server_default=sa.text("0")),
+        sa.ForeignKeyConstraint(["source_id"], ["sources.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["operator_id"], ["operators.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("source_id", "operator_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("source_wrr_state")
+    with op.batch_alter_table("sources") as batch_op:
+        batch_op.drop_column("distribution_mode")
@@ -0,0 +1,46 @@
+"""contacts autoincrement"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "202610191700"
+down_revision = "202610191600"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # SQLite не умеет добавить AUTOINCREMENT к существующей таблице — пересоздаём
+    with op.batch_alter_table(
+        "contacts", recreate="always", table_kwargs={"sqlite_autoincrement": True}
+    ):
+        pass
+
+    # Счётчик должен пропустить и id, уже переехавшие в архив
+    conn = op.get_bind()
+    last_id = conn.execute(
+        sa.text(
+            "SELECT max(id) FROM ("
+            "SELECT max(id) AS id FROM contacts UNION ALL "
+            "SELECT max(id) FROM contacts_archive)"
+        )
+    ).scalar()
+    if last_id is None:
+        return
+    updated = conn.execute(
+        sa.text("UPDATE sqlite_sequence SET seq = :seq WHERE name = 'contacts'"),
+        {"seq": last_id},
+    ).rowcount
+    if not updated:
+        conn.execute(
+            sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES ('contacts', :seq)"),
+            {"seq": last_id},
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table(
+        "contacts", recreate="always", table_kwargs={"sqlite_autoincrement": False}
+    ):
+        pass
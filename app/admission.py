@@ -0,0 +1,332 @@
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import hll, idempotency, models, sharding, versions
+
+ACCEPT = "accept"
+REJECT = "reject"
+PARK = "park"
+
+
+class TokenBucket:
+    """Классическое ведро токенов: `rate` токенов в секунду, не больше `burst` про запас."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self, now: Optional[float] = None) -> Tuple[bool, float]:
+        # (получилось ли, через сколько секунд появится следующий токен)
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate
+
+
+@dataclass
+class Decision:
+    action: str
+    retry_after: float = 0.0
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+@dataclass
+class _SourceLimits:
+    rate: Optional[float]
+    burst: Optional[int]
+    overflow_mode: str
+    bucket: Optional[TokenBucket] = None
+    accepted: int = 0
+    rejected: int = 0
+    parked: int = 0
+
+
+class AdmissionController:
+    """Допуск POST /contacts по источникам до любой работы с базой.
+
+    Лимиты источников держим в памяти: они обновляются при изменении источника в этом
+    процессе и периодически перечитываются из базы (`refresh`) — для остальных воркеров.
+    Ведра и счётчики у каждого воркера свои, так что лимит действует на процесс.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources: Dict[int, _SourceLimits] = {}
+
+    def configure(
+        self,
+        source_id: int,
+        rate: Optional[float],
+        burst: Optional[int],
+        overflow_mode: str = REJECT,
+    ) -> None:
+        with self._lock:
+            current = self._sources.get(source_id)
+            if current is None:
+                current = self._sources[source_id] = _SourceLimits(rate, burst, overflow_mode)
+            elif (current.rate, current.burst) == (rate, burst):
+                # Ведро с накопленными токенами сохраняем, меняется только режим
+                current.overflow_mode = overflow_mode
+                return
+            current.rate, current.burst, current.overflow_mode = rate, burst, overflow_mode
+            current.bucket = (
+                TokenBucket(rate, burst or max(1, math.ceil(rate))) if rate else None
+            )
+
+    def configure_source(self, source: models.Source) -> None:
+        self.configure(source.id, source.rate_limit, source.rate_burst, source.overflow_mode)
+
+    def refresh(self, db: Session) -> int:
+        rows = db.execute(
+            select(
+                models.Source.id,
+                models.Source.rate_limit,
+                models.Source.rate_burst,
+                models.Source.overflow_mode,
+            )
+        ).all()
+        for row in rows:
+            self.configure(row.id, row.rate_limit, row.rate_burst, row.overflow_mode)
+        return len(rows)
+
+    def check(self, source_id: int) -> Decision:
+        with self._lock:
+            limits = self._sources.get(source_id)
+            if limits is None:
+                # Неизвестный источник: пусть до него дойдёт обычная проверка (404)
+                return Decision(ACCEPT)
+            if limits.bucket is None:
+                limits.accepted += 1
+                return Decision(ACCEPT)
+            ok, retry_after = limits.bucket.try_acquire()
+            if ok:
+                limits.accepted += 1
+                return Decision(ACCEPT)
+            if limits.overflow_mode == PARK:
+                return Decision(PARK, retry_after)
+            limits.rejected += 1
+            return Decision(REJECT, retry_after)
+
+    def count(self, source_id: int, action: str) -> None:
+        # Припаркованное обращение учитываем, когда оно реально принято в буфер
+        with self._lock:
+            limits = self._sources.get(source_id)
+            if limits is None:
+                return
+            if action == PARK:
+                limits.parked += 1
+            elif action == REJECT:
+                limits.rejected += 1
+
+    def stats(self) -> List[Dict[str, object]]:
+        now = time.monotonic()
+        with self._lock:
+            result = []
+            for source_id, limits in sorted(self._sources.items()):
+                tokens = None
+                if limits.bucket is not None:
+                    bucket = limits.bucket
+                    tokens = min(
+                        bucket.burst, bucket.tokens + (now - bucket.updated_at) * bucket.rate
+                    )
+                result.append(
+                    {
+                        "source_id": source_id,
+                        "rate_limit": limits.rate,
+                        "rate_burst": limits.bucket.burst if limits.bucket else None,
+                        "overflow_mode": limits.overflow_mode,
+                        "tokens": tokens,
+                        "accepted": limits.accepted,
+                        "rejected": limits.rejected,
+                        "parked": limits.parked,
+                    }
+                )
+            return result
+
+
+@dataclass
+class ParkedContact:
+    source_id: int
+    lead_external_id: str
+    lead_name: Optional[str]
+    message: Optional[str]
+    idempotency_key: Optional[str] = None
+
+
+class ParkingBuffer:
+    """Обращения сверх лимита: без оператора, одной транзакцией на пачку.
+
+    Запрос лишь кладёт обращение в буфер; периодическая задача `flush` разрешает лидов
+    одним запросом на пачку и вставляет обращения без распределения. Повторы с уже
+    записанным (или встреченным в той же пачке) `Idempotency-Key` отбрасываются.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        batch_size: int = 500,
+        max_size: int = 10000,
+        idempotency_store: Optional[idempotency.IdempotencyStore] = None,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.idempotency_store = idempotency_store
+        self._lock = threading.Lock()
+        self._pending: List[ParkedContact] = []
+
+    def add(self, item: ParkedContact) -> bool:
+        with self._lock:
+            if len(self._pending) >= self.max_size:
+                return False
+            self._pending.append(item)
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        total = 0
+        while True:
+            with self._lock:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: self.batch_size]
+            if not batch:
+                return total
+            self._write(batch)
+            total += len(batch)
+
+    def _write(self, batch: List[ParkedContact]) -> None:
+        if sharding.router is None:
+            groups = [(self.session_factory, batch)]
+        else:
+            by_shard: Dict[int, List[ParkedContact]] = {}
+            for item in batch:
+                shard = sharding.router.shard_for_source(item.source_id)
+                by_shard.setdefault(shard, []).append(item)
+            groups = [
+                (sharding.router.session_factories[shard], items)
+                for shard, items in sorted(by_shard.items())
+            ]
+
+        for index, (session_factory, items) in enumerate(groups):
+            try:
+                self._write_to(session_factory, items)
+            except Exception:
+                # Незаписанное возвращаем в начало буфера, следующий запуск попробует снова
+                unwritten = [item for _, rest in groups[index:] for item in rest]
+                with self._lock:
+                    self._pending[:0] = unwritten
+                raise
+
+    def _write_to(
+        self, session_factory: Callable[[], Session], batch: List[ParkedContact]
+    ) -> None:
+        db = session_factory()
+        try:
+            batch = self._drop_replays(db, batch)
+            if not batch:
+                db.commit()
+                return
+            lead_ids = _resolve_leads(db, batch)
+            contacts = []
+            for item in batch:
+                contact = models.Contact(
+                    lead_id=lead_ids[item.lead_external_id],
+                    source_id=item.source_id,
+                    operator_id=None,
+                    message=item.message,
+                )
+                if sharding.router is not None:
+                    contact.id = sharding.router.next_contact_id(item.source_id)
+                contacts.append(contact)
+            db.add_all(contacts)
+            db.flush()
+
+            leads_by_source: Dict[int, List[int]] = {}
+            for contact in contacts:
+                leads_by_source.setdefault(contact.source_id, []).append(contact.lead_id)
+            for source_id, source_leads in leads_by_source.items():
+                hll.record_leads(db, source_id, None, source_leads)
+
+            store = self.idempotency_store
+            keys = []
+            if store is not None:
+                keys = [
+                    store.record(db, item.idempotency_key, contact.id)
+                    for item, contact in zip(batch, contacts)
+                    if item.idempotency_key
+                ]
+            versions.bump(db, versions.CONTACTS)
+            db.commit()
+            for row in keys:
+                store.remember(row.key, row.contact_id, row.expires_at)
+        finally:
+            db.close()
+
+    def _drop_replays(
+        self, db: Session, batch: List[ParkedContact]
+    ) -> List[ParkedContact]:
+        if self.idempotency_store is None:
+            return batch
+        seen = self.idempotency_store.existing(
+            db, (item.idempotency_key for item in batch if item.idempotency_key)
+        )
+        result = []
+        for item in batch:
+            if item.idempotency_key:
+                if item.idempotency_key in seen:
+                    continue
+                seen.add(item.idempotency_key)
+            result.append(item)
+        return result
+
+
+def _resolve_leads(db: Session, batch: List[ParkedContact]) -> Dict[str, int]:
+    # Существующих лидов находим одним запросом, недостающих создаём
+    names = {item.lead_external_id: item.lead_name for item in batch if item.lead_name}
+    external_ids = {item.lead_external_id for item in batch}
+    found = dict(
+        db.execute(
+            select(models.Lead.external_id, models.Lead.id).where(
+                models.Lead.external_id.in_(external_ids)
+            )
+        ).all()
+    )
+    missing = [
+        models.Lead(external_id=external_id, name=names.get(external_id))
+        for external_id in sorted(external_ids - found.keys())
+    ]
+    if missing:
+        db.add_all(missing)
+        db.flush()
+        found.update({lead.external_id: lead.id for lead in missing})
+    return found
+
+
+def make_refresher(
+    controller: AdmissionController, session_factory: Callable[[], Session]
+) -> Callable[[], int]:
+    def refresh() -> int:
+        db = session_factory()
+        try:
+            return controller.refresh(db)
+        finally:
+            db.close()
+
+    return refresh
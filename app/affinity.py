@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, sharding
+from .settings import settings
+
+# Маркер «у лида нет активного оператора», чтобы не ходить в базу повторно
+_NONE = -1
+
+
+class AffinityCache:
+    """LRU `lead_id -> operator_id` последнего активного оператора лида.
+
+    Промахи добираются из `contacts`, а каждое новое назначение сразу обновляет кэш.
+    Значение может устареть (оператор отключён, обращение закрыто), поэтому
+    вызывающий код всё равно проверяет активность и `max_load` оператора.
+    """
+
+    def __init__(self, size: int = 100000):
+        self.size = size
+        self._data: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, lead_id: int) -> Optional[int]:
+        with self._lock:
+            cached = self._data.get(lead_id)
+            if cached is not None:
+                self._data.move_to_end(lead_id)
+                return None if cached == _NONE else cached
+
+        if sharding.router is not None:
+            operator_id = sharding.router.last_active_operator(lead_id)
+            self.set(lead_id, operator_id)
+            return operator_id
+
+        operator_id = db.scalar(
+            select(models.Contact.operator_id)
+            .where(
+                models.Contact.lead_id == lead_id,
+                models.Contact.is_active.is_(True),
+                models.Contact.operator_id.is_not(None),
+            )
+            .order_by(models.Contact.id.desc())
+            .limit(1)
+        )
+        self.set(lead_id, operator_id)
+        return operator_id
+
+    def set(self, lead_id: int, operator_id: Optional[int]) -> None:
+        with self._lock:
+            self._data[lead_id] = _NONE if operator_id is None else operator_id
+            self._data.move_to_end(lead_id)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def discard(self, lead_id: int) -> None:
+        with self._lock:
+            self._data.pop(lead_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+cache = AffinityCache(settings.affinity_cache_size)
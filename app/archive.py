@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import models, versions
+
+# Колонки, которые переезжают из `contacts` в `contacts_archive` один в один
+ARCHIVED_COLUMNS = (
+    "id",
+    "lead_id",
+    "source_id",
+    "operator_id",
+    "created_at",
+    "is_active",
+    "message",
+)
+
+
+def archive_closed_contacts(
+    db: Session,
+    retention: timedelta,
+    batch_size: int = 500,
+    max_batches: int = 0,
+) -> int:
+    """Переносит закрытые обращения старше `retention` в `contacts_archive`.
+
+    Каждая пачка — отдельная короткая транзакция, чтобы не держать запись надолго.
+    `max_batches` ограничивает работу одного запуска (0 — без ограничения).
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - retention
+    contact_cols = [getattr(models.Contact, name) for name in ARCHIVED_COLUMNS]
+    archive_cols = [getattr(models.ContactArchive, name) for name in ARCHIVED_COLUMNS]
+
+    total = 0
+    batches = 0
+    while True:
+        ids = db.scalars(
+            select(models.Contact.id)
+            .where(
+                models.Contact.is_active.is_(False),
+                models.Contact.created_at < cutoff,
+            )
+            .order_by(models.Contact.id)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            break
+
+        db.execute(
+            insert(models.ContactArchive).from_select(
+                archive_cols, select(*contact_cols).where(models.Contact.id.in_(ids))
+            )
+        )
+        # Ключи идемпотентности ссылаются на горячую таблицу — убираем их вместе с контактами
+        db.execute(
+            delete(models.IdempotencyKey).where(models.IdempotencyKey.contact_id.in_(ids))
+        )
+        db.execute(delete(models.Contact).where(models.Contact.id.in_(ids)))
+        versions.bump(db, versions.CONTACTS)
+        db.commit()
+
+        total += len(ids)
+        batches += 1
+        if len(ids) < batch_size or (max_batches and batches >= max_batches):
+            break
+
+    return total
+
+
+def make_archiver(
+    session_factory: Callable[[], Session],
+    retention: timedelta,
+    batch_size: int,
+    max_batches: int = 0,
+) -> Callable[[], int]:
+    def run() -> int:
+        db = session_factory()
+        try:
+            return archive_closed_contacts(db, retention, batch_size, max_batches)
+        finally:
+            db.close()
+
+    return run
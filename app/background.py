@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Фоновая задача, которая раз в `interval` секунд вызывает `func` в своём потоке."""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Any]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.failures = 0
+        self.last_started_at: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self) -> Any:
+        self.last_started_at = time.time()
+        started = time.perf_counter()
+        try:
+            result = self.func()
+        except Exception as exc:
+            self.failures += 1
+            self.last_error = str(exc)
+            logger.exception("Фоновая задача %s завершилась с ошибкой", self.name)
+            raise
+        finally:
+            self.runs += 1
+            self.last_duration = time.perf_counter() - started
+        self.last_result = result
+        self.last_error = None
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_started_at": self.last_started_at,
+            "last_duration": self.last_duration,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                # Ошибка уже залогирована, пробуем на следующем тике
+                pass
@@ -1,16 +1,112 @@
-from sqlalchemy import create_engine
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
-DATABASE_URL = "sqlite:///./app.db"
+from .settings import Settings, settings
+
+DATABASE_URL = settings.database_url
+
+# Наборы прагм SQLite. "default" — настройки SQLite как есть,
+# "wal" — читатели не блокируют единственного писателя и наоборот,
+# "durable" — то же, но с fsync на каждый commit.
+SQLITE_PROFILES: Dict[str, Dict[str, object]] = {
+    "default": {},
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,  # 64 МБ
+        "mmap_size": 268435456,  # 256 МБ
+        "busy_timeout": 5000,
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "busy_timeout": 5000,
+    },
+}
 
 
 class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
+def sqlite_pragmas(config: Settings) -> Dict[str, object]:
+    pragmas = dict(SQLITE_PROFILES[config.sqlite_profile])
+    overrides = {
+        "journal_mode": config.sqlite_journal_mode,
+        "synchronous": config.sqlite_synchronous,
+        "cache_size": config.sqlite_cache_size,
+        "mmap_size": config.sqlite_mmap_size,
+        "busy_timeout": config.sqlite_busy_timeout,
+    }
+    pragmas.update({name: value for name, value in overrides.items() if value})
+    return pragmas
+
+
+def create_app_engine(
+    url: str,
+    pragmas: Optional[Dict[str, object]] = None,
+    read_only: bool = False,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_timeout: int = 30,
+) -> Engine:
+    is_sqlite = url.startswith("sqlite")
+    kwargs: Dict[str, object] = {}
+    if not is_sqlite or ":memory:" not in url:
+        kwargs.update(
+            pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout
+        )
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        **kwargs,
+    )
+    if is_sqlite:
+        _apply_pragmas_on_connect(engine, pragmas or {}, read_only)
+    return engine
+
+
+def _apply_pragmas_on_connect(
+    engine: Engine, pragmas: Dict[str, object], read_only: bool
+) -> None:
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                # Режим журнала хранится в самом файле, его выставляет писатель
+                if read_only and name == "journal_mode":
+                    continue
+                cursor.execute(f"PRAGMA {name}={value}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+
+
+engine = create_app_engine(
+    settings.database_url,
+    pragmas=sqlite_pragmas(settings),
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+)
+
+# GET-эндпоинты читают через отдельный пул read-only соединений, чтобы долгие
+# выгрузки и статистика не занимали соединения писателя
+read_engine = create_app_engine(
+    settings.read_database_url or settings.database_url,
+    pragmas=sqlite_pragmas(settings),
+    read_only=True,
+    pool_size=settings.db_read_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
 )
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False)
@@ -0,0 +1,78 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from . import affinity, models, versions
+
+logger = logging.getLogger(__name__)
+
+
+def expire_stale_contacts(db: Session, batch_size: int = 500) -> int:
+    """Закрывает активные обращения, которые висят дольше таймаута своего источника.
+
+    Обновление идёт пачками по `batch_size` (выборка по индексу `(is_active, created_at)`),
+    каждая пачка — отдельный commit. Нагрузка операторов считается по активным
+    обращениям, так что освобождённый лимит виден сразу после commit.
+    """
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    sources = (
+        db.query(models.Source.id, models.Source.inactivity_timeout_minutes)
+        .filter(models.Source.inactivity_timeout_minutes > 0)
+        .all()
+    )
+
+    total = 0
+    for source_id, timeout in sources:
+        cutoff = now - timedelta(minutes=timeout)
+        while True:
+            rows = db.execute(
+                select(models.Contact.id, models.Contact.lead_id)
+                .where(
+                    models.Contact.is_active.is_(True),
+                    models.Contact.created_at < cutoff,
+                    models.Contact.source_id == source_id,
+                )
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            result = db.execute(
+                update(models.Contact)
+                .where(
+                    models.Contact.id.in_([row.id for row in rows]),
+                    models.Contact.is_active.is_(True),
+                )
+                .values(is_active=False)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                versions.bump(db, versions.CONTACTS)
+            db.commit()
+            # Закрытое обращение больше не держит лида за оператором: следующий
+            # промах кэша заново найдёт последнего активного оператора в базе
+            for lead_id in {row.lead_id for row in rows}:
+                affinity.cache.discard(lead_id)
+            total += result.rowcount
+            if len(rows) < batch_size:
+                break
+
+    logger.info(
+        "Истекло обращений: %s за %.3f с", total, time.perf_counter() - started
+    )
+    return total
+
+
+def make_expirer(session_factory: Callable[[], Session], batch_size: int) -> Callable[[], int]:
+    def run() -> int:
+        db = session_factory()
+        try:
+            return expire_stale_contacts(db, batch_size)
+        finally:
+            db.close()
+
+    return run
@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+def _utcnow() -> datetime:
+    # В SQLite время храним наивным UTC, как и server_default CURRENT_TIMESTAMP
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class IdempotencyStore:
+    """Ключи идемпотентности POST /contacts.
+
+    Ключ хранится в компактной таблице `idempotency_keys` (ключ -> id контакта, срок жизни),
+    перед ней — LRU в памяти процесса. Просроченные ключи удаляет периодический
+    `purge_expired` пачками, а не запрос за запросом.
+    """
+
+    def __init__(self, ttl_seconds: int = 86400, cache_size: int = 10000):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[int, datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, key: str) -> Optional[int]:
+        # Только LRU, без базы: годится для проверки до лимитов источника
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is None or cached[1] <= _utcnow():
+            return None
+        return cached[0]
+
+    def existing(self, db: Session, keys: Iterable[str]) -> Set[str]:
+        # Какие из ключей уже записаны; просроченные, но ещё не удалённые — освобождаем
+        keys = set(keys)
+        if not keys:
+            return set()
+        now = _utcnow()
+        db.execute(
+            delete(models.IdempotencyKey).where(
+                models.IdempotencyKey.key.in_(keys),
+                models.IdempotencyKey.expires_at <= now,
+            )
+        )
+        return set(
+            db.scalars(
+                select(models.IdempotencyKey.key).where(models.IdempotencyKey.key.in_(keys))
+            )
+        )
+
+    def lookup(self, db: Session, key: str) -> Optional[int]:
+        now = _utcnow()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                contact_id, expires_at = cached
+                if expires_at > now:
+                    self._cache.move_to_end(key)
+                    return contact_id
+                del self._cache[key]
+
+        row = db.execute(
+            select(models.IdempotencyKey.contact_id, models.IdempotencyKey.expires_at).where(
+                models.IdempotencyKey.key == key,
+                models.IdempotencyKey.expires_at > now,
+            )
+        ).first()
+        if row is None:
+            return None
+        self.remember(key, row.contact_id, row.expires_at)
+        return row.contact_id
+
+    def record(self, db: Session, key: str, contact_id: int) -> models.IdempotencyKey:
+        # Пишем в текущей транзакции вместе с контактом; в LRU кладём после commit.
+        # Просроченная, но ещё не удалённая строка держит первичный ключ — освобождаем его.
+        # Живой ключ параллельного повтора даст IntegrityError на flush: его разбирает вызывающий
+        now = _utcnow()
+        db.execute(
+            delete(models.IdempotencyKey).where(
+                models.IdempotencyKey.key == key,
+                models.IdempotencyKey.expires_at <= now,
+            )
+        )
+        row = models.IdempotencyKey(key=key, contact_id=contact_id, expires_at=now + self.ttl)
+        db.add(row)
+        db.flush()
+        return row
+
+    def remember(self, key: str, contact_id: int, expires_at: datetime) -> None:
+        with self._lock:
+            self._cache[key] = (contact_id, expires_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def purge_expired(self, db: Session, batch_size: int = 1000) -> int:
+        # Удаляем пачками, чтобы не держать блокировку записи надолго
+        now = _utcnow()
+        total = 0
+        while True:
+            expired = (
+                select(models.IdempotencyKey.key)
+                .where(models.IdempotencyKey.expires_at <= now)
+                .limit(batch_size)
+            )
+            result = db.execute(
+                delete(models.IdempotencyKey).where(models.IdempotencyKey.key.in_(expired))
+            )
+            db.commit()
+            total += result.rowcount
+            if result.rowcount < batch_size:
+                break
+
+        with self._lock:
+            for key in [k for k, (_, exp) in self._cache.items() if exp <= now]:
+                del self._cache[key]
+        return total
+
+
+def make_sweeper(
+    store: IdempotencyStore, session_factory: Callable[[], Session], batch_size: int
+) -> Callable[[], int]:
+    def sweep() -> int:
+        db = session_factory()
+        try:
+            return store.purge_expired(db, batch_size)
+        finally:
+            db.close()
+
+    return sweep
@@ -0,0 +1,212 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas, services, versions
+from .idempotency import IdempotencyStore
+
+logger = logging.getLogger(__name__)
+
+TICKET_PENDING = "pending"
+TICKET_DONE = "done"
+TICKET_FAILED = "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class Ticket:
+    id: str
+    contact_in: schemas.ContactCreate
+    idempotency_key: Optional[str] = None
+    status: str = TICKET_PENDING
+    contact: Optional[dict] = None
+    error: Optional[str] = None
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def wait(self, timeout: float) -> bool:
+        return self._done.wait(timeout)
+
+    def resolve(self, contact: dict) -> None:
+        self.contact = contact
+        self.status = TICKET_DONE
+        self._done.set()
+
+    def fail(self, error: str) -> None:
+        self.error = error
+        self.status = TICKET_FAILED
+        self._done.set()
+
+
+class IngestQueue:
+    """Очередь приёма обращений с групповой фиксацией.
+
+    Запросы только валидируются и кладутся в ограниченную очередь, отдельный
+    поток-писатель забирает их пачками и записывает одной транзакцией,
+    так что на пачку приходится один commit (и один fsync) вместо одного на запрос.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        maxsize: int = 1000,
+        batch_size: int = 100,
+        batch_wait_ms: int = 5,
+        tickets_limit: int = 10000,
+        idempotency: Optional[IdempotencyStore] = None,
+    ):
+        self.session_factory = session_factory
+        self.idempotency = idempotency
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.tickets_limit = tickets_limit
+        self._queue: "queue.Queue[Ticket]" = queue.Queue(maxsize=maxsize)
+        self._tickets: "OrderedDict[str, Ticket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # Публичный интерфейс
+
+    def submit(
+        self, contact_in: schemas.ContactCreate, idempotency_key: Optional[str] = None
+    ) -> Ticket:
+        self.start()
+        ticket = Ticket(
+            id=uuid.uuid4().hex, contact_in=contact_in, idempotency_key=idempotency_key
+        )
+        with self._lock:
+            self._tickets[ticket.id] = ticket
+            # Храним ограниченное число последних тикетов
+            while len(self._tickets) > self.tickets_limit:
+                self._tickets.popitem(last=False)
+        try:
+            self._queue.put_nowait(ticket)
+        except queue.Full:
+            with self._lock:
+                self._tickets.pop(ticket.id, None)
+            raise QueueFull()
+        return ticket
+
+    def get_ticket(self, ticket_id: str) -> Optional[Ticket]:
+        with self._lock:
+            return self._tickets.get(ticket_id)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="ingest-writer", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        # Поток дописывает всё, что уже стоит в очереди, и завершается
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # Поток-писатель
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            self._process(self._collect_batch(first))
+
+    def _collect_batch(self, first: Ticket) -> List[Ticket]:
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch: List[Ticket]) -> None:
+        try:
+            self._write(batch)
+        except Exception:
+            logger.exception("Групповая запись не удалась, пишем обращения по одному")
+            # Одна плохая заявка не должна валить всю пачку
+            for ticket in batch:
+                try:
+                    self._write([ticket])
+                except Exception as exc:
+                    ticket.fail(str(exc))
+
+    def _write(self, batch: List[Ticket]) -> None:
+        db = self.session_factory()
+        try:
+            created = []
+            recorded = []
+            new_contacts = 0
+            for ticket in batch:
+                contact = self._existing_contact(db, ticket)
+                if contact is None:
+                    new_contacts += 1
+                    data = ticket.contact_in
+                    contact = services.create_contact(
+                        db,
+                        source_id=data.source_id,
+                        lead_external_id=data.lead_external_id,
+                        lead_name=data.lead_name,
+                        message=data.message,
+                    )
+                    if ticket.idempotency_key and self.idempotency:
+                        row = self.idempotency.record(db, ticket.idempotency_key, contact.id)
+                        recorded.append((row.key, row.contact_id, row.expires_at))
+                created.append((ticket, contact))
+            if new_contacts:
+                # Одна версия на пачку, а не на каждое обращение
+                versions.bump(db, versions.CONTACTS)
+            db.commit()
+        except Exception:
+            db.rollback()
+            db.close()
+            raise
+
+        # Пачка уже зафиксирована — ошибки ниже не должны приводить к повторной записи
+        for key, contact_id, expires_at in recorded:
+            self.idempotency.remember(key, contact_id, expires_at)
+        try:
+            for ticket, contact in created:
+                try:
+                    out = schemas.ContactOut.model_validate(contact)
+                    ticket.resolve(out.model_dump(mode="json"))
+                except Exception as exc:
+                    ticket.fail(str(exc))
+        finally:
+            db.close()
+
+    def _existing_contact(self, db: Session, ticket: Ticket) -> Optional[models.Contact]:
+        # Повтор с тем же ключом мог прийти, пока первая заявка ждала в очереди
+        if not ticket.idempotency_key or not self.idempotency:
+            return None
+        contact_id = self.idempotency.lookup(db, ticket.idempotency_key)
+        if contact_id is None:
+            return None
+        return db.get(models.Contact, contact_id)
@@ -1,15 +1,157 @@
-from typing import List
+import csv
+import io
+import secrets
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
 
-from . import models, schemas, services
-from .database import Base, SessionLocal, engine
+from . import (
+    admission,
+    affinity,
+    archive,
+    expiry,
+    hll,
+    idempotency,
+    ingest,
+    models,
+    profiling,
+    schemas,
+    services,
+    sharding,
+    startup,
+    versions,
+    wrr,
+)
+from .background import PeriodicTask
+from .database import ReadSessionLocal, SessionLocal, engine
+from .settings import settings
 
-# Инициализация базы
-Base.metadata.create_all(bind=engine)
+idempotency_store = idempotency.IdempotencyStore(
+    ttl_seconds=settings.idempotency_ttl_seconds,
+    cache_size=settings.idempotency_cache_size,
+)
 
-app = FastAPI(title="Mini CRM Leads Distribution")
+ingest_queue = ingest.IngestQueue(
+    SessionLocal,
+    maxsize=settings.ingest_queue_size,
+    batch_size=settings.ingest_batch_size,
+    batch_wait_ms=settings.ingest_batch_wait_ms,
+    tickets_limit=settings.ingest_tickets_limit,
+    idempotency=idempotency_store,
+)
+
+admission_controller = admission.AdmissionController()
+
+parking_buffer = admission.ParkingBuffer(
+    SessionLocal,
+    batch_size=settings.admission_park_batch,
+    max_size=settings.admission_park_queue_size,
+    idempotency_store=idempotency_store,
+)
+
+refresh_admission = admission.make_refresher(admission_controller, SessionLocal)
+
+
+def _contacts_session_factories() -> List[Callable[[], Session]]:
+    # Таблицы обращений: либо основная база, либо файлы шардов
+    if sharding.router is None:
+        return [SessionLocal]
+    return sharding.router.session_factories
+
+
+def _make_background_tasks() -> List[PeriodicTask]:
+    tasks: List[PeriodicTask] = []
+    for index, factory in enumerate(_contacts_session_factories()):
+        suffix = f"[shard-{index}]" if sharding.router is not None else ""
+        tasks += [
+            PeriodicTask(
+                "idempotency-sweeper" + suffix,
+                settings.idempotency_sweep_interval,
+                idempotency.make_sweeper(
+                    idempotency_store, factory, settings.idempotency_sweep_batch
+                ),
+            ),
+            PeriodicTask(
+                "contacts-archiver" + suffix,
+                settings.archive_interval,
+                archive.make_archiver(
+                    factory,
+                    timedelta(days=settings.archive_retention_days),
+                    settings.archive_batch_size,
+                    settings.archive_max_batches,
+                ),
+            ),
+            PeriodicTask(
+                "contacts-expiry" + suffix,
+                settings.expiry_interval,
+                expiry.make_expirer(factory, settings.expiry_batch_size),
+            ),
+        ]
+    tasks += [
+        PeriodicTask(
+            "admission-refresh", settings.admission_refresh_interval, refresh_admission
+        ),
+        PeriodicTask(
+            "admission-parking", settings.admission_park_interval, parking_buffer.flush
+        ),
+        PeriodicTask(
+            "wrr-checkpoint",
+            settings.wrr_checkpoint_interval,
+            lambda: wrr.state.checkpoint(SessionLocal),
+        ),
+    ]
+    return tasks
+
+
+background_tasks = _make_background_tasks()
+
+readiness = startup.Readiness()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схему ведёт Alembic: при расхождении ревизий не стартуем вовсе
+    if settings.schema_check:
+        startup.check_schema(engine)
+    if sharding.router is not None:
+        # Миграции ведут только глобальную базу, таблицы шардов создаём по моделям
+        sharding.router.create_schema()
+    refresh_admission()
+    readiness.run_warm_up(SessionLocal, idempotency_store, settings.warmup_leads)
+    for task in background_tasks:
+        task.start()
+    yield
+    readiness.mark_not_ready("shutdown")
+    for task in background_tasks:
+        task.stop()
+    # Дописываем то, что уже принято в очередь и в буфер парковки
+    ingest_queue.stop()
+    parking_buffer.flush()
+    wrr.state.checkpoint(SessionLocal)
+
+
+app = FastAPI(title="Mini CRM Leads Distribution", lifespan=lifespan)
+
+response_cache = versions.ResponseCache(settings.etag_cache_size)
+
+profile_store = profiling.ProfileStore(settings.profiling_dir, settings.profiling_keep)
+if settings.profiling_enabled:
+    # Подключаем до объявления маршрутов, иначе эндпоинты не будут обёрнуты
+    profiling.install(
+        app, profile_store, settings.profiling_sample_rate, settings.admin_token
+    )
+
+if settings.gzip_enabled:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.gzip_min_size)
 
 
 def get_db():
@@ -20,9 +162,128 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_ingest_queue() -> ingest.IngestQueue:
+    return ingest_queue
+
+
+def get_idempotency_store() -> idempotency.IdempotencyStore:
+    return idempotency_store
+
+
+def get_profile_store() -> profiling.ProfileStore:
+    return profile_store
+
+
+def get_readiness() -> startup.Readiness:
+    return readiness
+
+
+def get_admission() -> admission.AdmissionController:
+    return admission_controller
+
+
+def get_parking_buffer() -> admission.ParkingBuffer:
+    return parking_buffer
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    if not settings.admin_token or not x_admin_token or not secrets.compare_digest(
+        x_admin_token, settings.admin_token
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа")
+
+
+def _read_versions(db: Session, entities: Iterable[str]) -> dict:
+    current = versions.read(db, entities)
+    # С шардами версия обращений ведётся в каждом шарде; сумма растёт при любом изменении
+    if sharding.router is not None and versions.CONTACTS in current:
+        current[versions.CONTACTS] = sum(
+            sharding.router.fan_out(
+                lambda shard_db: versions.read(shard_db, [versions.CONTACTS])[versions.CONTACTS]
+            )
+        )
+    return current
+
+
+@contextmanager
+def _contacts_db(db: Session, source_id: int):
+    # С шардами обращения источника живут в его файле; глобальная база подключена к нему
+    if sharding.router is None:
+        yield db
+        return
+    shard_db = sharding.router.session_for_source(source_id)
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+def _conditional_json(
+    request: Request,
+    db: Session,
+    entities: Iterable[str],
+    adapter: TypeAdapter,
+    render: Callable[[], Any],
+) -> Response:
+    # Данные меняются редко, а UI опрашивает постоянно: по одному чтению версий
+    # отвечаем 304 или отдаём уже сериализованное тело из кэша
+    etag = versions.make_etag(str(request.url), _read_versions(db, entities))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if versions.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    body = response_cache.get(etag)
+    if body is None:
+        body = adapter.dump_json(render())
+        response_cache.put(etag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Ответы с выборочными полями (`fields=` / `include=`) — просто списки словарей
+_SPARSE_ADAPTER = TypeAdapter(List[Dict[str, Any]])
+
+
+def _sparse_fields(
+    value: str, allowed: Iterable[str], param: str, required: Iterable[str] = ("id",)
+) -> List[str]:
+    # Имена через запятую плюс обязательные (`id`). Неизвестное имя — 400, а не пустое поле
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = sorted(set(names) - set(allowed))
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неизвестные значения {param}: {', '.join(unknown)}",
+        )
+    return list(dict.fromkeys([*required, *names]))
+
+
 # Операторы
 
 
+@app.get("/health/live")
+def health_live():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready", response_model=schemas.ReadinessOut)
+def health_ready(
+    response: Response, readiness: startup.Readiness = Depends(get_readiness)
+):
+    # 503, пока не прошёл прогрев (и после начала остановки) — балансировщик не шлёт трафик
+    snapshot = readiness.snapshot()
+    if not snapshot["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return snapshot
+
+
 @app.post("/operators", response_model=schemas.OperatorOut, status_code=status.HTTP_201_CREATED)
 def create_operator(
     operator_in: schemas.OperatorCreate, db: Session = Depends(get_db)
@@ -35,40 +296,104 @@ def create_operator(
         )
     operator = models.Operator(**operator_in.model_dump())
     db.add(operator)
+    versions.bump(db, versions.OPERATORS)
     db.commit()
     db.refresh(operator)
     return operator
 
 
+_OPERATORS_ADAPTER = TypeAdapter(List[schemas.OperatorOut])
+
+OPERATOR_FIELDS = tuple(schemas.OperatorOut.model_fields)
+
+
 @app.get("/operators", response_model=List[schemas.OperatorOut])
-def list_operators(db: Session = Depends(get_db)):
-    operators = db.query(models.Operator).order_by(models.Operator.id).all()
-    return operators
+def list_operators(
+    request: Request,
+    fields: Optional[str] = Query(None, description="Поля через запятую, например id,name"),
+    db: Session = Depends(get_read_db),
+):
+    if fields is None:
+
+        def render():
+            return db.query(models.Operator).order_by(models.Operator.id).all()
+
+        return _conditional_json(request, db, [versions.OPERATORS], _OPERATORS_ADAPTER, render)
+
+    columns = _sparse_fields(fields, OPERATOR_FIELDS, "fields")
+
+    def render_sparse():
+        rows = db.execute(
+            select(*[getattr(models.Operator, name) for name in columns]).order_by(
+                models.Operator.id
+            )
+        )
+        return [dict(row._mapping) for row in rows]
+
+    return _conditional_json(request, db, [versions.OPERATORS], _SPARSE_ADAPTER, render_sparse)
 
 
 @app.patch("/operators/{operator_id}", response_model=schemas.OperatorOut)
 def update_operator(
-    operator_id: int, operator_in: schemas.OperatorUpdate, db: Session = Depends(get_db)
+    operator_id: int,
+    operator_in: schemas.OperatorUpdate,
+    response: Response,
+    db: Session = Depends(get_db),
 ):
     operator = db.get(models.Operator, operator_id)
     if not operator:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Оператор не найден")
 
+    old_active, old_max_load = operator.active, operator.max_load
     data = operator_in.model_dump(exclude_unset=True)
     for field, value in data.items():
         setattr(operator, field, value)
 
     db.add(operator)
+    db.flush()
+    versions.bump(db, versions.OPERATORS)
+
+    # Отключили или урезали лимит — сразу раздаём лишние обращения в той же транзакции
+    shrunk = (old_active and not operator.active) or operator.max_load < old_max_load
+    result = None
+    if settings.rebalance_on_update and shrunk:
+        result = services.rebalance_operator(db, operator.id)
+        response.headers["X-Rebalanced-Contacts"] = str(result.moved)
+        if result.moved:
+            versions.bump(db, versions.CONTACTS)
+
     db.commit()
+    if result is not None:
+        services.apply_affinity(result)
     db.refresh(operator)
     return operator
 
 
+@app.post("/operators/{operator_id}/drain", response_model=schemas.RebalanceOut)
+def drain_operator(operator_id: int, db: Session = Depends(get_db)):
+    operator = db.get(models.Operator, operator_id)
+    if not operator:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Оператор не найден")
+
+    result = services.rebalance_operator(db, operator.id)
+    if result.moved:
+        versions.bump(db, versions.CONTACTS)
+    db.commit()
+    services.apply_affinity(result)
+    return schemas.RebalanceOut(
+        operator_id=operator.id, moved=result.moved, unplaced=result.unplaced
+    )
+
+
 # Источники и конфигурация весов
 
 
 @app.post("/sources", response_model=schemas.SourceOut, status_code=status.HTTP_201_CREATED)
-def create_source(source_in: schemas.SourceCreate, db: Session = Depends(get_db)):
+def create_source(
+    source_in: schemas.SourceCreate,
+    db: Session = Depends(get_db),
+    admission_control: admission.AdmissionController = Depends(get_admission),
+):
     existing = (
         db.query(models.Source)
         .filter(
@@ -84,39 +409,82 @@ def create_source(source_in: schemas.SourceCreate, db: Session = Depends(get_db)
         )
     source = models.Source(**source_in.model_dump())
     db.add(source)
+    versions.bump(db, versions.SOURCES)
     db.commit()
     db.refresh(source)
+    admission_control.configure_source(source)
     return source
 
 
+_SOURCES_ADAPTER = TypeAdapter(List[schemas.SourceOut])
+_SOURCE_DETAIL_ADAPTER = TypeAdapter(schemas.SourceDetailOut)
+
+
 @app.get("/sources", response_model=List[schemas.SourceOut])
-def list_sources(db: Session = Depends(get_db)):
-    sources = db.query(models.Source).order_by(models.Source.id).all()
-    return sources
+def list_sources(request: Request, db: Session = Depends(get_read_db)):
+    def render():
+        return db.query(models.Source).order_by(models.Source.id).all()
+
+    return _conditional_json(request, db, [versions.SOURCES], _SOURCES_ADAPTER, render)
 
 
 @app.get("/sources/{source_id}", response_model=schemas.SourceDetailOut)
-def get_source_detail(source_id: int, db: Session = Depends(get_db)):
+def get_source_detail(source_id: int, request: Request, db: Session = Depends(get_read_db)):
+    def render():
+        source = db.get(models.Source, source_id)
+        if not source:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Источник не найден"
+            )
+        return _source_detail_out(source)
+
+    # Источники не удаляются, так что совпавший ETag означает, что источник есть.
+    # Но `*` совпадает с любым ETag — тут без проверки существования был бы 304 вместо 404
+    if_none_match = request.headers.get("if-none-match") or ""
+    if "*" in [item.strip() for item in if_none_match.split(",")]:
+        if db.get(models.Source, source_id) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Источник не найден"
+            )
+
+    # Имена операторов в ответе — тоже часть версии
+    return _conditional_json(
+        request,
+        db,
+        [versions.SOURCES, versions.OPERATORS],
+        _SOURCE_DETAIL_ADAPTER,
+        render,
+    )
+
+
+@app.patch("/sources/{source_id}", response_model=schemas.SourceDetailOut)
+def update_source(
+    source_id: int,
+    source_in: schemas.SourceUpdate,
+    db: Session = Depends(get_db),
+    admission_control: admission.AdmissionController = Depends(get_admission),
+):
     source = db.get(models.Source, source_id)
     if not source:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Источник не найден")
 
-    operators = []
-    for cfg in source.operator_configs:
-        operators.append(
-            schemas.SourceOperatorWeightOut(
-                operator_id=cfg.operator_id,
-                operator_name=cfg.operator.name,
-                weight=cfg.weight,
-            )
-        )
+    data = source_in.model_dump(exclude_unset=True)
+    for field, value in data.items():
+        setattr(source, field, value)
 
-    return schemas.SourceDetailOut(
-        id=source.id,
-        name=source.name,
-        code=source.code,
-        operators=operators,
-    )
+    db.add(source)
+    versions.bump(db, versions.SOURCES)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Источник с таким именем или кодом уже существует",
+        )
+    db.refresh(source)
+    admission_control.configure_source(source)
+    return _source_detail_out(source)
 
 
 @app.put("/sources/{source_id}/operators", response_model=schemas.SourceDetailOut)
@@ -156,10 +524,16 @@ def set_source_operators(
         )
         db.add(cfg)
 
+    versions.bump(db, versions.SOURCES)
     db.commit()
     db.refresh(source)
+    wrr.state.reset(source_id)
+
+    return _source_detail_out(source)
+
 
-    operators_out = [
+def _source_detail_out(source: models.Source) -> schemas.SourceDetailOut:
+    operators = [
         schemas.SourceOperatorWeightOut(
             operator_id=cfg.operator_id,
             operator_name=cfg.operator.name,
@@ -172,77 +546,493 @@ def set_source_operators(
         id=source.id,
         name=source.name,
         code=source.code,
-        operators=operators_out,
+        sticky_routing=source.sticky_routing,
+        inactivity_timeout_minutes=source.inactivity_timeout_minutes,
+        rate_limit=source.rate_limit,
+        rate_burst=source.rate_burst,
+        overflow_mode=source.overflow_mode,
+        distribution_mode=source.distribution_mode,
+        operators=operators,
     )
 
 
 # Регистрация обращения
 
 
-@app.post("/contacts", response_model=schemas.ContactOut, status_code=status.HTTP_201_CREATED)
+@app.post(
+    "/contacts",
+    response_model=schemas.ContactOut,
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_202_ACCEPTED: {"model": schemas.ContactTicketOut},
+        status.HTTP_429_TOO_MANY_REQUESTS: {"description": "Превышен лимит источника"},
+    },
+)
 def create_contact(
     contact_in: schemas.ContactCreate,
+    response: Response,
+    wait_ms: Optional[int] = Query(None, ge=0),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
     db: Session = Depends(get_db),
+    queue: ingest.IngestQueue = Depends(get_ingest_queue),
+    store: idempotency.IdempotencyStore = Depends(get_idempotency_store),
+    admission_control: admission.AdmissionController = Depends(get_admission),
+    parking: admission.ParkingBuffer = Depends(get_parking_buffer),
 ):
+    # Лимит источника проверяем в памяти, до любых запросов к базе. Повтор с ключом,
+    # который уже есть в LRU, сразу отдаём исходным контактом и токен не тратим
+    if idempotency_key and store.cached(idempotency_key) is not None:
+        decision = admission.Decision(admission.ACCEPT)
+    else:
+        decision = admission_control.check(contact_in.source_id)
+    if decision.action == admission.PARK:
+        parked = parking.add(
+            admission.ParkedContact(
+                source_id=contact_in.source_id,
+                lead_external_id=contact_in.lead_external_id,
+                lead_name=contact_in.lead_name,
+                message=contact_in.message,
+                idempotency_key=idempotency_key,
+            )
+        )
+        admission_control.count(
+            contact_in.source_id, admission.PARK if parked else admission.REJECT
+        )
+        if parked:
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=schemas.ContactParkedOut(
+                    source_id=contact_in.source_id,
+                    lead_external_id=contact_in.lead_external_id,
+                ).model_dump(),
+            )
+    if decision.action != admission.ACCEPT:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Превышен лимит обращений источника",
+            headers={"Retry-After": decision.retry_after_header},
+        )
+
+    with _contacts_db(db, contact_in.source_id) as contacts_db:
+        result = _register_contact(
+            contact_in, response, wait_ms, idempotency_key, contacts_db, queue, store
+        )
+        # Сессия шарда закрывается на выходе, поэтому сериализуем, пока связи доступны
+        if isinstance(result, models.Contact):
+            return schemas.ContactOut.model_validate(result)
+        return result
+
+
+def _register_contact(
+    contact_in: schemas.ContactCreate,
+    response: Response,
+    wait_ms: Optional[int],
+    idempotency_key: Optional[str],
+    db: Session,
+    queue: ingest.IngestQueue,
+    store: idempotency.IdempotencyStore,
+):
+    # Повтор с уже известным ключом: отдаём исходный контакт, не трогая лидов и распределение
+    if idempotency_key:
+        replayed = _replay_contact(db, store, idempotency_key)
+        if replayed is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return replayed
+
     source = db.get(models.Source, contact_in.source_id)
     if not source:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Источник не найден")
 
-    lead = services.get_or_create_lead(
-        db, external_id=contact_in.lead_external_id, name=contact_in.lead_name
-    )
-
-    operator = services.pick_operator_for_source(db, source.id)
+    # Писатель очереди работает с основной базой, поэтому с шардами пишем синхронно
+    if settings.ingest_async and sharding.router is None:
+        return _enqueue_contact(queue, contact_in, wait_ms, idempotency_key)
 
-    contact = models.Contact(
-        lead_id=lead.id,
+    contact = services.create_contact(
+        db,
         source_id=source.id,
-        operator_id=operator.id if operator else None,
+        lead_external_id=contact_in.lead_external_id,
+        lead_name=contact_in.lead_name,
         message=contact_in.message,
     )
-    db.add(contact)
-    db.commit()
+    lead_id = contact.lead_id
+    key_expires_at = None
+    try:
+        if idempotency_key:
+            key_expires_at = store.record(db, idempotency_key, contact.id).expires_at
+        versions.bump(db, versions.CONTACTS)
+        db.commit()
+    except IntegrityError:
+        # Параллельный повтор с тем же ключом успел зафиксироваться раньше
+        db.rollback()
+        # Наше назначение откатилось — закрепление лида берём заново из базы
+        affinity.cache.discard(lead_id)
+        replayed = _replay_contact(db, store, idempotency_key) if idempotency_key else None
+        if replayed is None:
+            raise
+        response.headers["Idempotent-Replayed"] = "true"
+        return replayed
+
+    if key_expires_at is not None:
+        store.remember(idempotency_key, contact.id, key_expires_at)
     db.refresh(contact)
 
     return contact
 
 
+def _replay_contact(
+    db: Session, store: idempotency.IdempotencyStore, key: str
+) -> Optional[models.Contact]:
+    contact_id = store.lookup(db, key)
+    if contact_id is None:
+        return None
+    return db.get(models.Contact, contact_id)
+
+
+def _enqueue_contact(
+    queue: ingest.IngestQueue,
+    contact_in: schemas.ContactCreate,
+    wait_ms: Optional[int],
+    idempotency_key: Optional[str] = None,
+):
+    try:
+        ticket = queue.submit(contact_in, idempotency_key=idempotency_key)
+    except ingest.QueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Очередь приёма обращений переполнена",
+            headers={"Retry-After": "1"},
+        )
+
+    # Клиент может подождать результат несколько миллисекунд вместо опроса тикета
+    if wait_ms:
+        ticket.wait(min(wait_ms, settings.ingest_max_wait_ms) / 1000)
+        if ticket.status == ingest.TICKET_DONE:
+            return ticket.contact
+
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=_ticket_out(ticket).model_dump(mode="json"),
+    )
+
+
+def _ticket_out(ticket: ingest.Ticket) -> schemas.ContactTicketOut:
+    return schemas.ContactTicketOut(
+        ticket_id=ticket.id,
+        status=ticket.status,
+        contact=ticket.contact,
+        error=ticket.error,
+    )
+
+
+@app.get("/contacts/tickets/{ticket_id}", response_model=schemas.ContactTicketOut)
+def get_contact_ticket(
+    ticket_id: str, queue: ingest.IngestQueue = Depends(get_ingest_queue)
+):
+    ticket = queue.get_ticket(ticket_id)
+    if not ticket:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Тикет не найден")
+    return _ticket_out(ticket)
+
+
 # Просмотр состояния
 
 
+LEAD_FIELDS = tuple(schemas.LeadOut.model_fields)
+CONTACT_FIELDS = (
+    "id",
+    "created_at",
+    "is_active",
+    "message",
+    "source_id",
+    "operator_id",
+    "archived",
+)
+LEAD_INCLUDES = ("contacts", "contacts.source", "contacts.operator")
+# Вложенные объекты обращения: модель и отдаваемые колонки
+_CONTACT_NESTED = {
+    "source": (models.Source, tuple(schemas.SourceOut.model_fields)),
+    "operator": (models.Operator, OPERATOR_FIELDS),
+}
+
+
 @app.get("/leads", response_model=List[schemas.LeadWithContactsOut])
-def list_leads(db: Session = Depends(get_db)):
+def list_leads(
+    include_archived: bool = False,
+    fields: Optional[str] = Query(
+        None, description="Поля лида и обращений, например id,external_id,contacts.is_active"
+    ),
+    include: Optional[str] = Query(
+        None, description="Вложенные объекты: " + ",".join(LEAD_INCLUDES)
+    ),
+    db: Session = Depends(get_read_db),
+):
+    if fields is not None or include is not None:
+        return _list_leads_sparse(db, include_archived, fields or "", include or "")
+
     leads = db.query(models.Lead).order_by(models.Lead.id).all()
-    result: List[schemas.LeadWithContactsOut] = []
-
-    for lead in leads:
-        contacts_short = [
-            schemas.ContactShort(
-                id=c.id,
-                created_at=c.created_at,
-                is_active=c.is_active,
-                message=c.message,
-                source=c.source,
-                operator=c.operator,
+
+    if sharding.router is None:
+        contacts_by_lead = _contacts_by_lead(db, include_archived)
+    else:
+        # Шарды читаем параллельно и сливаем: сначала архив, внутри — по id
+        contacts_by_lead = defaultdict(list)
+        parts = sharding.router.fan_out(
+            lambda shard_db: _contacts_by_lead(shard_db, include_archived)
+        )
+        for part in parts:
+            for lead_id, items in part.items():
+                contacts_by_lead[lead_id].extend(items)
+        for items in contacts_by_lead.values():
+            items.sort(key=lambda item: (not item.archived, item.id))
+
+    return [
+        schemas.LeadWithContactsOut(
+            id=lead.id,
+            external_id=lead.external_id,
+            name=lead.name,
+            contacts=contacts_by_lead.get(lead.id, []),
+        )
+        for lead in leads
+    ]
+
+
+def _list_leads_sparse(
+    db: Session, include_archived: bool, fields: str, include: str
+) -> Response:
+    # Только запрошенные колонки: без ORM-объектов, вложенных схем и тяжёлого message.
+    # Обращения — только если они упомянуты в fields или include
+    names = _sparse_fields(
+        fields, [*LEAD_FIELDS, *(f"contacts.{name}" for name in CONTACT_FIELDS)], "fields"
+    )
+    includes = _sparse_fields(include, LEAD_INCLUDES, "include", required=())
+    lead_fields = [name for name in names if "." not in name]
+    contact_fields = [name.split(".", 1)[1] for name in names if "." in name]
+    nested = [name.split(".", 1)[1] for name in includes if "." in name]
+
+    rows = db.execute(
+        select(*[getattr(models.Lead, name) for name in lead_fields]).order_by(models.Lead.id)
+    )
+    leads = [dict(row._mapping) for row in rows]
+
+    if includes or contact_fields:
+        # Без contacts.* в fields у обращения только id (и вложенные объекты из include):
+        # message и прочие колонки отдаются лишь по явному запросу
+        contact_fields = list(dict.fromkeys(["id", *contact_fields]))
+        columns = [name for name in contact_fields if name != "archived"]
+        columns += [f"{name}_id" for name in nested if f"{name}_id" not in columns]
+        if sharding.router is None:
+            contacts_by_lead = _sparse_contacts_by_lead(db, include_archived, columns)
+        else:
+            contacts_by_lead = defaultdict(list)
+            parts = sharding.router.fan_out(
+                lambda shard_db: _sparse_contacts_by_lead(shard_db, include_archived, columns)
             )
-            for c in lead.contacts
-        ]
-        result.append(
-            schemas.LeadWithContactsOut(
-                id=lead.id,
-                external_id=lead.external_id,
-                name=lead.name,
-                contacts=contacts_short,
+            for part in parts:
+                for lead_id, items in part.items():
+                    contacts_by_lead[lead_id].extend(items)
+            for items in contacts_by_lead.values():
+                items.sort(key=lambda item: (not item["archived"], item["id"]))
+
+        contacts = [item for items in contacts_by_lead.values() for item in items]
+        for name in nested:
+            _attach_nested(db, contacts, name)
+        # Служебные колонки (признак архива, id для вложенных объектов) — только по запросу
+        hidden = {"archived", "source_id", "operator_id"} - set(contact_fields)
+        for item in contacts:
+            for name in hidden & item.keys():
+                del item[name]
+        for lead in leads:
+            lead["contacts"] = contacts_by_lead.get(lead["id"], [])
+
+    return Response(content=_SPARSE_ADAPTER.dump_json(leads), media_type="application/json")
+
+
+def _sparse_contacts_by_lead(
+    db: Session, include_archived: bool, columns: List[str]
+) -> Dict[int, List[Dict[str, Any]]]:
+    tables = [(models.Contact, False)]
+    if include_archived:
+        tables.insert(0, (models.ContactArchive, True))
+
+    result: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for model, archived in tables:
+        rows = db.execute(
+            select(model.lead_id, *[getattr(model, name) for name in columns]).order_by(
+                model.id
             )
         )
+        for row in rows:
+            item = dict(row._mapping)
+            lead_id = item.pop("lead_id")
+            item["archived"] = archived
+            result[lead_id].append(item)
     return result
 
 
+def _attach_nested(db: Session, contacts: List[Dict[str, Any]], name: str) -> None:
+    # Источники и операторы одним запросом на все обращения, только нужные колонки
+    model, columns = _CONTACT_NESTED[name]
+    ids = {item[f"{name}_id"] for item in contacts if item[f"{name}_id"] is not None}
+    found = {}
+    if ids:
+        rows = db.execute(
+            select(*[getattr(model, column) for column in columns]).where(model.id.in_(ids))
+        )
+        found = {row.id: dict(row._mapping) for row in rows}
+    for item in contacts:
+        item[name] = found.get(item[f"{name}_id"])
+
+
+def _contacts_by_lead(
+    db: Session, include_archived: bool
+) -> Dict[int, List[schemas.ContactShort]]:
+    # Обращения (и архивные) всех лидов — по запросу на таблицу, источники и операторы
+    # подгружаются пачкой, а не по одному на обращение
+    tables = [models.Contact]
+    if include_archived:
+        tables.insert(0, models.ContactArchive)
+
+    result: Dict[int, List[schemas.ContactShort]] = defaultdict(list)
+    for model in tables:
+        rows = (
+            db.query(model)
+            .options(selectinload(model.source), selectinload(model.operator))
+            .order_by(model.id)
+        )
+        for c in rows:
+            result[c.lead_id].append(
+                schemas.ContactShort(
+                    id=c.id,
+                    created_at=c.created_at,
+                    is_active=c.is_active,
+                    message=c.message,
+                    source=c.source,
+                    operator=c.operator,
+                    archived=model is models.ContactArchive,
+                )
+            )
+    return result
+
+
+EXPORT_COLUMNS = [
+    "id",
+    "lead_id",
+    "lead_external_id",
+    "source_id",
+    "operator_id",
+    "created_at",
+    "is_active",
+    "message",
+    "archived",
+]
+
+
+@app.get("/contacts/export")
+def export_contacts(
+    source_id: Optional[int] = None,
+    include_archived: bool = False,
+    batch_size: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_read_db),
+):
+    # CSV отдаём потоком, читая таблицы страницами по id
+    tables = [(models.Contact, False)]
+    if include_archived:
+        tables.insert(0, (models.ContactArchive, True))
+
+    # С шардами выгрузка источника читает только его шард, общая — шарды по очереди
+    if sharding.router is None:
+        factories = [lambda: db]
+    elif source_id is not None:
+        factories = [lambda: sharding.router.session_for_source(source_id, read=True)]
+    else:
+        factories = sharding.router.read_session_factories
+
+    def pages():
+        try:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(EXPORT_COLUMNS)
+            for factory in factories:
+                contacts_db = factory()
+                try:
+                    yield from _export_pages(
+                        contacts_db, tables, source_id, batch_size, buf, writer
+                    )
+                finally:
+                    contacts_db.close()
+            yield buf.getvalue()
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        pages(),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="contacts.csv"'},
+    )
+
+
+def _export_pages(
+    db: Session,
+    tables,
+    source_id: Optional[int],
+    batch_size: int,
+    buf: io.StringIO,
+    writer,
+):
+    for model, archived in tables:
+        last_id = 0
+        while True:
+            query = (
+                select(
+                    model.id,
+                    model.lead_id,
+                    models.Lead.external_id,
+                    model.source_id,
+                    model.operator_id,
+                    model.created_at,
+                    model.is_active,
+                    model.message,
+                )
+                .join(models.Lead, models.Lead.id == model.lead_id)
+                .where(model.id > last_id)
+                .order_by(model.id)
+                .limit(batch_size)
+            )
+            if source_id is not None:
+                query = query.where(model.source_id == source_id)
+            rows = db.execute(query).all()
+            if not rows:
+                break
+            for row in rows:
+                writer.writerow([*row, archived])
+            last_id = rows[-1].id
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+
+_OPERATOR_STATS_ADAPTER = TypeAdapter(List[schemas.OperatorStatsItem])
+
+
 @app.get("/stats/operators", response_model=List[schemas.OperatorStatsItem])
-def operators_stats(db: Session = Depends(get_db)):
+def operators_stats(
+    request: Request,
+    source_id: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
+    return _conditional_json(
+        request,
+        db,
+        [versions.OPERATORS, versions.SOURCES, versions.CONTACTS],
+        _OPERATOR_STATS_ADAPTER,
+        lambda: _operators_stats(db, source_id),
+    )
+
+
+def _operator_source_counts(db: Session, source_id: Optional[int] = None) -> list:
     from sqlalchemy import func
 
-    rows = (
+    query = (
         db.query(
             models.Operator.id,
             models.Operator.name,
@@ -253,8 +1043,34 @@ def operators_stats(db: Session = Depends(get_db)):
         .join(models.Contact, models.Contact.operator_id == models.Operator.id)
         .join(models.Source, models.Source.id == models.Contact.source_id)
         .group_by(models.Operator.id, models.Source.id)
-        .all()
     )
+    if source_id is not None:
+        query = query.filter(models.Contact.source_id == source_id)
+    return query.all()
+
+
+def _operators_stats(
+    db: Session, source_id: Optional[int] = None
+) -> List[schemas.OperatorStatsItem]:
+    if sharding.router is None:
+        rows = _operator_source_counts(db, source_id)
+    elif source_id is not None:
+        # Статистика одного источника — только из его шарда
+        shard_db = sharding.router.session_for_source(source_id, read=True)
+        try:
+            rows = _operator_source_counts(shard_db, source_id)
+        finally:
+            shard_db.close()
+    else:
+        # Оператор мог получать обращения из источников разных шардов — складываем
+        merged = {}
+        parts = sharding.router.fan_out(lambda shard_db: _operator_source_counts(shard_db))
+        for part in parts:
+            for op_id, op_name, src_id, src_name, cnt in part:
+                key = (op_id, src_id)
+                prev = merged.get(key)
+                merged[key] = (op_id, op_name, src_id, src_name, cnt + (prev[4] if prev else 0))
+        rows = [merged[key] for key in sorted(merged)]
 
     stats_map = {}
     for op_id, op_name, src_id, src_name, cnt in rows:
@@ -284,3 +1100,168 @@ def operators_stats(db: Session = Depends(get_db)):
         for data in stats_map.values()
     ]
     return result
+
+
+UNIQUE_LEADS_GROUPS = {
+    "total": (),
+    "source": ("source_id",),
+    "operator": ("operator_id",),
+    "source_operator": ("source_id", "operator_id"),
+}
+
+
+@app.get(
+    "/stats/unique-leads",
+    response_model=List[schemas.UniqueLeadsItem],
+    response_model_exclude_unset=True,
+)
+def unique_leads_stats(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    group_by: Literal["total", "source", "operator", "source_operator"] = "source_operator",
+    source_id: Optional[int] = None,
+    operator_id: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
+    # Уникальные лиды считаем по дневным HyperLogLog-скетчам, а не COUNT(DISTINCT)
+    def sketch_rows(sketch_db: Session) -> list:
+        query = sketch_db.query(
+            models.LeadSketch.source_id,
+            models.LeadSketch.operator_id,
+            models.LeadSketch.registers,
+        )
+        if date_from is not None:
+            query = query.filter(models.LeadSketch.day >= date_from)
+        if date_to is not None:
+            query = query.filter(models.LeadSketch.day <= date_to)
+        if source_id is not None:
+            query = query.filter(models.LeadSketch.source_id == source_id)
+        if operator_id is not None:
+            query = query.filter(models.LeadSketch.operator_id == operator_id)
+        return query.all()
+
+    if sharding.router is None:
+        rows = sketch_rows(db)
+    elif source_id is not None:
+        # Скетчи источника лежат в его шарде
+        shard_db = sharding.router.session_for_source(source_id, read=True)
+        try:
+            rows = sketch_rows(shard_db)
+        finally:
+            shard_db.close()
+    else:
+        rows = [row for part in sharding.router.fan_out(sketch_rows) for row in part]
+
+    fields = UNIQUE_LEADS_GROUPS[group_by]
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(getattr(row, name) for name in fields)].append(row.registers)
+
+    # В строке только поля группировки: null в ней — обращения без оператора,
+    # а не «не группировали по этому полю»
+    return [
+        schemas.UniqueLeadsItem(
+            **dict(zip(fields, key)), unique_leads=hll.merge_sketches(blobs).count()
+        )
+        for key, blobs in sorted(
+            groups.items(), key=lambda item: [(v is None, v or 0) for v in item[0]]
+        )
+    ]
+
+
+@app.get("/stats/admission", response_model=List[schemas.AdmissionStatsItem])
+def admission_stats(
+    admission_control: admission.AdmissionController = Depends(get_admission),
+):
+    # Счётчики этого воркера: сколько обращений принято, отклонено и припарковано
+    return admission_control.stats()
+
+
+# Служебные операции
+
+
+@app.post(
+    "/admin/archive",
+    response_model=schemas.ArchiveRunOut,
+    dependencies=[Depends(require_admin)],
+)
+def run_archive(db: Session = Depends(get_db)):
+    def run(contacts_db: Session) -> int:
+        return archive.archive_closed_contacts(
+            contacts_db,
+            timedelta(days=settings.archive_retention_days),
+            settings.archive_batch_size,
+            settings.archive_max_batches,
+        )
+
+    return schemas.ArchiveRunOut(archived=_run_on_contacts(db, run))
+
+
+@app.post(
+    "/admin/expire",
+    response_model=schemas.ExpiryRunOut,
+    dependencies=[Depends(require_admin)],
+)
+def run_expiry(db: Session = Depends(get_db)):
+    def run(contacts_db: Session) -> int:
+        return expiry.expire_stale_contacts(contacts_db, settings.expiry_batch_size)
+
+    return schemas.ExpiryRunOut(expired=_run_on_contacts(db, run))
+
+
+def _run_on_contacts(db: Session, run: Callable[[Session], int]) -> int:
+    # Обслуживание таблиц обращений: в основной базе или во всех шардах параллельно
+    if sharding.router is None:
+        return run(db)
+    return sum(sharding.router.fan_out(run, read=False))
+
+
+@app.get(
+    "/admin/tasks",
+    response_model=List[schemas.BackgroundTaskStats],
+    dependencies=[Depends(require_admin)],
+)
+def list_background_tasks():
+    return [task.stats() for task in background_tasks]
+
+
+@app.post(
+    "/admin/unique-leads/rebuild",
+    response_model=schemas.SketchRebuildOut,
+    dependencies=[Depends(require_admin)],
+)
+def rebuild_unique_leads(db: Session = Depends(get_db)):
+    return schemas.SketchRebuildOut(contacts=_run_on_contacts(db, hll.rebuild_sketches))
+
+
+@app.get(
+    "/admin/profiles",
+    response_model=List[schemas.ProfileInfo],
+    dependencies=[Depends(require_admin)],
+)
+def list_profiles(store: profiling.ProfileStore = Depends(get_profile_store)):
+    return store.list()
+
+
+@app.get(
+    "/admin/profiles/{profile_id}",
+    response_model=schemas.ProfileDetail,
+    dependencies=[Depends(require_admin)],
+)
+def get_profile(profile_id: str, store: profiling.ProfileStore = Depends(get_profile_store)):
+    data = store.get(profile_id)
+    if data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Профиль не найден")
+    return data
+
+
+@app.get("/admin/profiles/{profile_id}/download", dependencies=[Depends(require_admin)])
+def download_profile(
+    profile_id: str, store: profiling.ProfileStore = Depends(get_profile_store)
+):
+    path = store.prof_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Профиль не найден")
+    return FileResponse(
+        path, media_type="application/octet-stream", filename=f"{profile_id}.prof"
+    )
@@ -1,11 +1,15 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional
 
 from sqlalchemy import (
     Boolean,
+    Date,
     DateTime,
+    Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
     UniqueConstraint,
@@ -59,6 +63,21 @@ class Source(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String(100), unique=True, nullable=False)
     code: Mapped[Optional[str]] = mapped_column(String(100), unique=True, nullable=True)
+    # Возвращать лида к его последнему активному оператору, а не разыгрывать заново
+    sticky_routing: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    # Через сколько минут без закрытия активное обращение истекает (None — никогда)
+    inactivity_timeout_minutes: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # Допуск обращений: токенов в секунду и размер всплеска (None — без ограничения);
+    # сверх лимита — 429 ("reject") или обращение без оператора ("park")
+    rate_limit: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    rate_burst: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    overflow_mode: Mapped[str] = mapped_column(
+        String(10), default="reject", server_default="reject", nullable=False
+    )
+    # Выбор оператора: "random" — лотерея по весам, "smooth" — плавный round-robin
+    distribution_mode: Mapped[str] = mapped_column(
+        String(10), default="random", server_default="random", nullable=False
+    )
 
     operator_configs: Mapped[List["SourceOperatorConfig"]] = relationship(
         back_populates="source", cascade="all, delete-orphan"
@@ -100,6 +119,25 @@ class SourceOperatorConfig(Base):
         )
 
 
+class SourceWrrState(Base):
+    # Сохранённые текущие веса плавного round-robin источника (см. wrr.py)
+    __tablename__ = "source_wrr_state"
+
+    source_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("sources.id", ondelete="CASCADE"), primary_key=True
+    )
+    operator_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("operators.id", ondelete="CASCADE"), primary_key=True
+    )
+    current: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return (
+            f"SourceWrrState(source_id={self.source_id}, "
+            f"operator_id={self.operator_id}, current={self.current})"
+        )
+
+
 class Contact(Base):
     __tablename__ = "contacts"
 
@@ -129,5 +167,95 @@ class Contact(Base):
     source: Mapped["Source"] = relationship(back_populates="contacts")
     operator: Mapped[Optional["Operator"]] = relationship(back_populates="contacts")
 
+    __table_args__ = (
+        Index("ix_contacts_is_active_created_at", "is_active", "created_at"),
+        # Без AUTOINCREMENT SQLite выдаёт max(id) + 1, и после архивации свежих
+        # обращений их id достались бы новым — а в contacts_archive они уже заняты
+        {"sqlite_autoincrement": True},
+    )
+
     def __repr__(self) -> str:
         return f"Contact(id={self.id}, lead_id={self.lead_id}, source_id={self.source_id})"
+
+
+class ContactArchive(Base):
+    # Холодная копия закрытых обращений, вынесенных из `contacts` архиватором
+    __tablename__ = "contacts_archive"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    lead_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("leads.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    source_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("sources.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    operator_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("operators.id", ondelete="SET NULL"), nullable=True
+    )
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    source: Mapped["Source"] = relationship()
+    operator: Mapped[Optional["Operator"]] = relationship()
+
+    def __repr__(self) -> str:
+        return (
+            f"ContactArchive(id={self.id}, lead_id={self.lead_id}, "
+            f"source_id={self.source_id})"
+        )
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    contact_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("contacts.id", ondelete="CASCADE"), nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+    def __repr__(self) -> str:
+        return f"IdempotencyKey(key={self.key!r}, contact_id={self.contact_id})"
+
+
+class LeadSketch(Base):
+    # HyperLogLog-скетч уникальных лидов за день в разрезе источника и оператора
+    __tablename__ = "lead_sketches"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    source_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("sources.id", ondelete="CASCADE"), nullable=False
+    )
+    operator_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("operators.id", ondelete="CASCADE"), nullable=True
+    )
+    day: Mapped[date] = mapped_column(Date, nullable=False, index=True)
+    registers: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("source_id", "operator_id", "day", name="uix_lead_sketch"),
+    )
+
+    def __repr__(self) -> str:
+        return (
+            f"LeadSketch(source_id={self.source_id}, "
+            f"operator_id={self.operator_id}, day={self.day})"
+        )
+
+
+class DataVersion(Base):
+    # Счётчик версии данных по типу сущности, из него строятся ETag для GET
+    __tablename__ = "data_versions"
+
+    entity: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"DataVersion(entity={self.entity!r}, version={self.version})"
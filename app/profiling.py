@@ -0,0 +1,280 @@
+import cProfile
+import functools
+import inspect
+import io
+import json
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Профиль текущего запроса; None — запрос не профилируется
+_current: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+
+# С Python 3.12 в процессе может работать только один cProfile: кто не успел взять
+# замок, профилируется без него — только таймлайн SQL
+_cprofile_lock = threading.Lock()
+
+_PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+_SQL_LIMIT = 500
+_STATEMENT_LIMIT = 1000
+
+
+@dataclass
+class ProfileSession:
+    method: str
+    path: str
+    id: str = field(
+        default_factory=lambda: f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    )
+    started_at: float = field(default_factory=time.time)
+    status: Optional[int] = None
+    duration_ms: Optional[float] = None
+    profiler: Optional[cProfile.Profile] = None
+    sql: List[Dict[str, Any]] = field(default_factory=list)
+    _started: float = field(default_factory=time.perf_counter)
+
+    def offset_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def finish(self) -> None:
+        self.duration_ms = self.offset_ms()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "sql_count": len(self.sql),
+            "sql_ms": sum(item["duration_ms"] for item in self.sql),
+        }
+
+
+class ProfileStore:
+    """Кольцевой буфер профилей на диске: хранятся последние `keep` штук.
+
+    На каждый профиль два файла: `<id>.prof` (дамп cProfile для pstats/snakeviz)
+    и `<id>.json` (метаданные, таймлайн SQL и текстовая сводка).
+    """
+
+    def __init__(self, directory: str, keep: int = 50):
+        self.directory = Path(directory)
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def save(self, session: ProfileSession) -> None:
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            summary = "cProfile пропущен: в процессе уже шёл другой профиль"
+            if session.profiler is not None:
+                session.profiler.dump_stats(str(self._path(session.id, ".prof")))
+                out = io.StringIO()
+                stats = pstats.Stats(session.profiler, stream=out)
+                stats.sort_stats("cumulative").print_stats(30)
+                summary = out.getvalue()
+
+            data = session.info()
+            data["sql"] = session.sql
+            data["summary"] = summary
+            self._path(session.id, ".json").write_text(
+                json.dumps(data, ensure_ascii=False), encoding="utf-8"
+            )
+            self._trim()
+
+    def list(self) -> List[Dict[str, Any]]:
+        result = []
+        for path in self._json_files():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            data.pop("sql", None)
+            data.pop("summary", None)
+            result.append(data)
+        return sorted(result, key=lambda item: item["started_at"], reverse=True)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(profile_id, ".json")
+        if path is None or not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def prof_path(self, profile_id: str) -> Optional[Path]:
+        path = self._path(profile_id, ".prof")
+        if path is None or not path.exists():
+            return None
+        return path
+
+    def _path(self, profile_id: str, suffix: str) -> Optional[Path]:
+        # id приходит из URL — пускаем только свой формат, без выхода из каталога
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        return self.directory / f"{profile_id}{suffix}"
+
+    def _json_files(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob("*.json"))
+
+    def _trim(self) -> None:
+        files = self._json_files()
+        for path in files[: max(len(files) - self.keep, 0)]:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".prof").unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """ASGI-мидлварь, решающая, профилировать ли запрос.
+
+    Сам cProfile включается в обёртке эндпоинта (`ProfiledRoute`): синхронные
+    эндпоинты выполняются в пуле потоков, а cProfile видит только свой поток.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: ProfileStore,
+        sample_rate: float = 0.0,
+        admin_token: str = "",
+    ):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        session = ProfileSession(method=scope["method"], path=scope["path"])
+        token = _current.set(session)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                session.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            session.finish()
+            await anyio.to_thread.run_sync(self.store.save, session)
+
+    def _should_profile(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") == b"1" and self.admin_token:
+            token = headers.get(b"x-admin-token", b"").decode("latin-1")
+            if secrets.compare_digest(token, self.admin_token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+
+def _start_cprofile(session: Optional[ProfileSession]) -> bool:
+    # Профилирование не должно ронять настоящий запрос: не вышло — работаем без cProfile
+    if session is None or not _cprofile_lock.acquire(blocking=False):
+        return False
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Профилировщик включил кто-то ещё (другой инструмент в процессе)
+        _cprofile_lock.release()
+        return False
+    session.profiler = profiler
+    return True
+
+
+def _stop_cprofile(session: ProfileSession) -> None:
+    try:
+        session.profiler.disable()
+    finally:
+        _cprofile_lock.release()
+
+
+def _profiled(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            session = _current.get()
+            if not _start_cprofile(session):
+                return await endpoint(*args, **kwargs)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _stop_cprofile(session)
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        session = _current.get()
+        if not _start_cprofile(session):
+            return endpoint(*args, **kwargs)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            _stop_cprofile(session)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    session = _current.get()
+    if session is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    session = _current.get()
+    if session is None:
+        return
+    started_stack = conn.info.get("profile_started")
+    if not started_stack:
+        return
+    started = started_stack.pop()
+    duration_ms = (time.perf_counter() - started) * 1000
+    if len(session.sql) < _SQL_LIMIT:
+        session.sql.append(
+            {
+                "offset_ms": round(session.offset_ms() - duration_ms, 3),
+                "duration_ms": round(duration_ms, 3),
+                "statement": statement[:_STATEMENT_LIMIT],
+            }
+        )
+
+
+def install(app, store: ProfileStore, sample_rate: float, admin_token: str) -> None:
+    """Подключает профилирование к приложению.
+
+    Вызывать до объявления маршрутов: обёртка эндпоинтов ставится через `route_class`.
+    """
+    app.router.route_class = ProfiledRoute
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=store,
+        sample_rate=sample_rate,
+        admin_token=admin_token,
+    )
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 
 class OperatorCreate(BaseModel):
@@ -30,6 +30,31 @@ class OperatorOut(BaseModel):
 class SourceCreate(BaseModel):
     name: str
     code: Optional[str] = None
+    sticky_routing: bool = False
+    inactivity_timeout_minutes: Optional[int] = Field(None, ge=1)
+    rate_limit: Optional[float] = Field(None, gt=0)
+    rate_burst: Optional[int] = Field(None, ge=1)
+    overflow_mode: Literal["reject", "park"] = "reject"
+    distribution_mode: Literal["random", "smooth"] = "random"
+
+
+class SourceUpdate(BaseModel):
+    name: Optional[str] = None
+    code: Optional[str] = None
+    sticky_routing: Optional[bool] = None
+    inactivity_timeout_minutes: Optional[int] = Field(None, ge=1)
+    rate_limit: Optional[float] = Field(None, gt=0)
+    rate_burst: Optional[int] = Field(None, ge=1)
+    overflow_mode: Optional[Literal["reject", "park"]] = None
+    distribution_mode: Optional[Literal["random", "smooth"]] = None
+
+    # Поле можно не передавать, но явный null для NOT NULL-колонок — ошибка запроса
+    @field_validator("name", "sticky_routing", "overflow_mode", "distribution_mode")
+    @classmethod
+    def _not_null(cls, value):
+        if value is None:
+            raise ValueError("значение не может быть null")
+        return value
 
 
 class SourceOut(BaseModel):
@@ -52,6 +77,12 @@ class SourceOperatorWeightOut(BaseModel):
 
 
 class SourceDetailOut(SourceOut):
+    sticky_routing: bool
+    inactivity_timeout_minutes: Optional[int]
+    rate_limit: Optional[float]
+    rate_burst: Optional[int]
+    overflow_mode: str
+    distribution_mode: str
     operators: List[SourceOperatorWeightOut]
 
 
@@ -77,6 +108,7 @@ class ContactShort(BaseModel):
     message: Optional[str]
     source: SourceOut
     operator: Optional[OperatorOut]
+    archived: bool = False
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -97,6 +129,95 @@ class ContactOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ContactTicketOut(BaseModel):
+    ticket_id: str
+    status: str
+    contact: Optional[ContactOut] = None
+    error: Optional[str] = None
+
+
+class ArchiveRunOut(BaseModel):
+    archived: int
+
+
+class ProfileInfo(BaseModel):
+    id: str
+    method: str
+    path: str
+    status: Optional[int]
+    started_at: float
+    duration_ms: Optional[float]
+    sql_count: int
+    sql_ms: float
+
+
+class ProfileSqlItem(BaseModel):
+    offset_ms: float
+    duration_ms: float
+    statement: str
+
+
+class ProfileDetail(ProfileInfo):
+    sql: List[ProfileSqlItem]
+    summary: str
+
+
+class UniqueLeadsItem(BaseModel):
+    source_id: Optional[int] = None
+    operator_id: Optional[int] = None
+    unique_leads: int
+
+
+class SketchRebuildOut(BaseModel):
+    contacts: int
+
+
+class RebalanceOut(BaseModel):
+    operator_id: int
+    moved: int
+    unplaced: int
+
+
+class ExpiryRunOut(BaseModel):
+    expired: int
+
+
+class BackgroundTaskStats(BaseModel):
+    name: str
+    interval: float
+    running: bool
+    runs: int
+    failures: int
+    last_started_at: Optional[float]
+    last_duration: Optional[float]
+    last_result: Optional[int]
+    last_error: Optional[str]
+
+
+class ContactParkedOut(BaseModel):
+    status: str = "parked"
+    source_id: int
+    lead_external_id: str
+
+
+class AdmissionStatsItem(BaseModel):
+    source_id: int
+    rate_limit: Optional[float]
+    rate_burst: Optional[int]
+    overflow_mode: str
+    tokens: Optional[float]
+    accepted: int
+    rejected: int
+    parked: int
+
+
+class ReadinessOut(BaseModel):
+    ready: bool
+    reason: Optional[str]
+    warmup: Dict[str, int]
+    warmup_seconds: Optional[float]
+
+
 class OperatorSourceCount(BaseModel):
     source_id: int
     source_name: str
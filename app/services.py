@@ -1,9 +1,14 @@
-from typing import List, Optional
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
-from sqlalchemy import func
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 
-from . import models
+from . import affinity, hll, models, sharding, versions, wrr
+
+logger = logging.getLogger(__name__)
 
 
 def get_or_create_lead(
@@ -24,10 +29,10 @@ def get_or_create_lead(
     return lead
 
 
-def _get_available_configs_for_source(
+def _active_configs_for_source(
     db: Session, source_id: int
 ) -> List[models.SourceOperatorConfig]:
-    configs = (
+    return (
         db.query(models.SourceOperatorConfig)
         .join(models.SourceOperatorConfig.operator)
         .filter(
@@ -36,6 +41,12 @@ def _get_available_configs_for_source(
         )
         .all()
     )
+
+
+def _get_available_configs_for_source(
+    db: Session, source_id: int
+) -> List[models.SourceOperatorConfig]:
+    configs = _active_configs_for_source(db, source_id)
     if not configs:
         return []
 
@@ -43,16 +54,7 @@ def _get_available_configs_for_source(
     if not operator_ids:
         return []
 
-    load_rows = (
-        db.query(models.Contact.operator_id, func.count(models.Contact.id))
-        .filter(
-            models.Contact.operator_id.in_(operator_ids),
-            models.Contact.is_active.is_(True),
-        )
-        .group_by(models.Contact.operator_id)
-        .all()
-    )
-    loads = {op_id: count for op_id, count in load_rows}
+    loads = _active_loads(db, operator_ids)
 
     available: List[models.SourceOperatorConfig] = []
     for cfg in configs:
@@ -87,8 +89,32 @@ def _choose_operator_weighted(
     return None
 
 
-def pick_operator_for_source(db: Session, source_id: int) -> Optional[models.Operator]:
+def _pick_operator_smooth(db: Session, source_id: int) -> Optional[models.Operator]:
+    # Один запрос нагрузки на все маршруты; перегруженные пропускаются в том же проходе
+    # round-robin, так что повторных розыгрышей и проверок нет
+    configs = _active_configs_for_source(db, source_id)
+    if not configs:
+        return None
+    loads = _active_loads(db, [cfg.operator_id for cfg in configs])
+    weights = {cfg.operator_id: cfg.weight for cfg in configs if cfg.weight > 0}
+    saturated = {
+        cfg.operator_id
+        for cfg in configs
+        if loads.get(cfg.operator_id, 0) >= cfg.operator.max_load
+    }
+    operator_id = wrr.state.pick(db, source_id, weights, skip=saturated)
+    if operator_id is None:
+        return None
+    return next(cfg.operator for cfg in configs if cfg.operator_id == operator_id)
+
+
+def pick_operator_for_source(
+    db: Session, source_id: int, mode: str = wrr.RANDOM
+) -> Optional[models.Operator]:
     # Возвращаем оператора с учётом весов и лимитов
+    if mode == wrr.SMOOTH:
+        return _pick_operator_smooth(db, source_id)
+
     configs = _get_available_configs_for_source(db, source_id)
     if not configs:
         return None
@@ -100,18 +126,241 @@ def pick_operator_for_source(db: Session, source_id: int) -> Optional[models.Ope
         if op is None:
             return None
 
-        current_load = (
-            db.query(func.count(models.Contact.id))
-            .filter(
-                models.Contact.operator_id == op.id,
-                models.Contact.is_active.is_(True),
-            )
-            .scalar()
-        ) or 0
-
-        if op.active and current_load < op.max_load:
+        if op.active and _active_load(db, op.id) < op.max_load:
             return op
 
         remaining = [cfg for cfg in remaining if cfg.operator_id != op.id]
 
     return None
+
+
+def _active_loads(db: Session, operator_ids: List[int]) -> Dict[int, int]:
+    # С шардами обращения оператора разбросаны по файлам всех источников — суммируем
+    if sharding.router is not None:
+        return sharding.router.active_loads(operator_ids)
+    load_rows = (
+        db.query(models.Contact.operator_id, func.count(models.Contact.id))
+        .filter(
+            models.Contact.operator_id.in_(operator_ids),
+            models.Contact.is_active.is_(True),
+        )
+        .group_by(models.Contact.operator_id)
+        .all()
+    )
+    return {op_id: count for op_id, count in load_rows}
+
+
+def _active_load(db: Session, operator_id: int) -> int:
+    if sharding.router is not None:
+        return sharding.router.active_loads([operator_id]).get(operator_id, 0)
+    return (
+        db.query(func.count(models.Contact.id))
+        .filter(
+            models.Contact.operator_id == operator_id,
+            models.Contact.is_active.is_(True),
+        )
+        .scalar()
+    ) or 0
+
+
+def pick_operator_for_lead(
+    db: Session, source: models.Source, lead_id: int
+) -> Optional[models.Operator]:
+    # В режиме sticky_routing сначала пробуем последнего активного оператора лида,
+    # даже если лид пришёл из другого бота; лотерея — только при промахе или перегрузке
+    if source.sticky_routing:
+        operator_id = affinity.cache.get(db, lead_id)
+        if operator_id is not None:
+            op = db.get(models.Operator, operator_id)
+            if op and op.active and _active_load(db, op.id) < op.max_load:
+                return op
+
+    return pick_operator_for_source(db, source.id, source.distribution_mode)
+
+
+def create_contact(
+    db: Session,
+    source_id: int,
+    lead_external_id: str,
+    lead_name: Optional[str] = None,
+    message: Optional[str] = None,
+) -> models.Contact:
+    # Лид, выбор оператора и сам контакт в рамках текущей транзакции (без commit)
+    lead = get_or_create_lead(db, external_id=lead_external_id, name=lead_name)
+    source = db.get(models.Source, source_id)
+    operator = pick_operator_for_lead(db, source, lead.id)
+
+    contact = models.Contact(
+        lead_id=lead.id,
+        source_id=source_id,
+        operator_id=operator.id if operator else None,
+        message=message,
+    )
+    if sharding.router is not None:
+        contact.id = sharding.router.next_contact_id(source_id)
+    db.add(contact)
+    db.flush()
+    if operator is not None:
+        affinity.cache.set(lead.id, operator.id)
+    hll.record_lead(db, source_id, contact.operator_id, lead.id)
+    return contact
+
+
+@dataclass
+class RebalanceResult:
+    moved: int = 0
+    unplaced: int = 0
+    # lead_id -> новый оператор; в кэш закрепления попадает только после commit
+    affinity: Dict[int, int] = field(default_factory=dict)
+
+
+def rebalance_operator(db: Session, operator_id: int) -> RebalanceResult:
+    """Перераспределяет лишние активные обращения оператора (без commit).
+
+    Лишние — все активные, если оператор отключён, иначе сверх `max_load`.
+    Уходят самые свежие обращения; каждое — к подходящему оператору своего
+    источника с учётом весов и лимитов. Назначения считаются в памяти и
+    применяются пачкой UPDATE ... WHERE id IN (...) на каждого получателя.
+    Кэш закрепления лидов вызывающий обновляет после своего commit (`apply_affinity`).
+
+    С шардами план строится по всем шардам сразу, а UPDATE в каждом шарде
+    фиксируется его собственной транзакцией (вместе с версией обращений шарда)
+    до commit вызывающего. Это не атомарно: если шард не зафиксировался, его
+    обращения остаются у оператора и считаются в `unplaced`; уже зафиксированные
+    шарды не откатываются — их обращения и так ушли к операторам в пределах лимитов.
+    """
+    op = db.get(models.Operator, operator_id)
+    if op is None:
+        return RebalanceResult()
+
+    if sharding.router is None:
+        active = _active_contacts(db, operator_id)
+    else:
+        active = [
+            row
+            for part in sharding.router.fan_out(
+                lambda shard_db: _active_contacts(shard_db, operator_id)
+            )
+            for row in part
+        ]
+        # id шардов чередуются, поэтому «самые свежие» — по времени создания
+        active.sort(key=lambda row: (row.created_at, row.id), reverse=True)
+    surplus = len(active) if not op.active else len(active) - op.max_load
+    if surplus <= 0:
+        return RebalanceResult()
+    to_move = active[:surplus]
+
+    # Кандидаты по источникам: активные операторы с положительным весом, кроме текущего
+    source_ids = {row.source_id for row in to_move}
+    candidates: Dict[int, Dict[int, int]] = defaultdict(dict)
+    limits: Dict[int, int] = {}
+    rows = (
+        db.query(
+            models.SourceOperatorConfig.source_id,
+            models.SourceOperatorConfig.operator_id,
+            models.SourceOperatorConfig.weight,
+            models.Operator.max_load,
+        )
+        .join(models.Operator, models.Operator.id == models.SourceOperatorConfig.operator_id)
+        .filter(
+            models.SourceOperatorConfig.source_id.in_(source_ids),
+            models.SourceOperatorConfig.operator_id != operator_id,
+            models.SourceOperatorConfig.weight > 0,
+            models.Operator.active.is_(True),
+        )
+        .all()
+    )
+    for source_id, cand_id, weight, max_load in rows:
+        candidates[source_id][cand_id] = weight
+        limits[cand_id] = max_load
+
+    loads: Dict[int, int] = defaultdict(int)
+    if limits:
+        loads.update(_active_loads(db, list(limits)))
+
+    moves = []
+    current: Dict[int, Dict[int, int]] = defaultdict(dict)
+    result = RebalanceResult()
+    for row in to_move:
+        weights = {
+            cand_id: weight
+            for cand_id, weight in candidates.get(row.source_id, {}).items()
+            if loads[cand_id] < limits[cand_id]
+        }
+        target = wrr.smooth_weighted_pick(weights, current[row.source_id])
+        if target is None:
+            result.unplaced += 1
+            continue
+        loads[target] += 1
+        moves.append((row, target))
+
+    if sharding.router is None:
+        _apply_assignments(db, _group_by_target(moves))
+        _count_moves(result, moves)
+        return result
+
+    by_shard: Dict[int, list] = defaultdict(list)
+    for row, target in moves:
+        by_shard[sharding.router.shard_for_contact(row.id)].append((row, target))
+    for shard, shard_moves in by_shard.items():
+        shard_db = sharding.router.session_factories[shard]()
+        try:
+            _apply_assignments(shard_db, _group_by_target(shard_moves))
+            versions.bump(shard_db, versions.CONTACTS)
+            shard_db.commit()
+        except Exception:
+            shard_db.rollback()
+            logger.exception("Перераспределение в шарде %s не зафиксировано", shard)
+            result.unplaced += len(shard_moves)
+            continue
+        finally:
+            shard_db.close()
+        _count_moves(result, shard_moves)
+    return result
+
+
+def apply_affinity(result: RebalanceResult) -> None:
+    # Только после commit: откат не должен оставить лидов за операторами, к которым
+    # их обращения так и не перешли
+    for lead_id, operator_id in result.affinity.items():
+        affinity.cache.set(lead_id, operator_id)
+
+
+def _group_by_target(moves) -> Dict[int, List[int]]:
+    assignments: Dict[int, List[int]] = defaultdict(list)
+    for row, target in moves:
+        assignments[target].append(row.id)
+    return assignments
+
+
+def _count_moves(result: RebalanceResult, moves) -> None:
+    # Обращения идут от свежих к старым: лид закрепляется за оператором самого свежего
+    for row, target in moves:
+        result.moved += 1
+        result.affinity.setdefault(row.lead_id, target)
+
+
+def _active_contacts(db: Session, operator_id: int):
+    return (
+        db.query(
+            models.Contact.id,
+            models.Contact.source_id,
+            models.Contact.lead_id,
+            models.Contact.created_at,
+        )
+        .filter(
+            models.Contact.operator_id == operator_id,
+            models.Contact.is_active.is_(True),
+        )
+        .order_by(models.Contact.id.desc())
+        .all()
+    )
+
+
+def _apply_assignments(db: Session, assignments: Dict[int, List[int]]) -> None:
+    for target, contact_ids in assignments.items():
+        db.execute(
+            update(models.Contact)
+            .where(models.Contact.id.in_(contact_ids))
+            .values(operator_id=target)
+        )
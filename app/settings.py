@@ -0,0 +1,145 @@
+import os
+from dataclasses import dataclass, field
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+@dataclass
+class Settings:
+    # База данных и пул соединений
+    database_url: str = field(
+        default_factory=lambda: os.getenv("DATABASE_URL", "sqlite:///./app.db")
+    )
+    # Отдельный URL для чтения (реплика); по умолчанию та же база, но соединения read-only
+    read_database_url: str = field(default_factory=lambda: os.getenv("READ_DATABASE_URL", ""))
+    db_pool_size: int = field(default_factory=lambda: _env_int("DB_POOL_SIZE", 5))
+    db_max_overflow: int = field(default_factory=lambda: _env_int("DB_MAX_OVERFLOW", 10))
+    db_pool_timeout: int = field(default_factory=lambda: _env_int("DB_POOL_TIMEOUT", 30))
+    db_read_pool_size: int = field(default_factory=lambda: _env_int("DB_READ_POOL_SIZE", 10))
+
+    # Шарды обращений: через запятую URL файлов SQLite; источник пишет в шард source_id % N.
+    # Пусто — все таблицы в DATABASE_URL
+    shard_database_urls: str = field(
+        default_factory=lambda: os.getenv("SHARD_DATABASE_URLS", "")
+    )
+
+    # Профиль SQLite (см. SQLITE_PROFILES в database.py) и точечные переопределения прагм
+    sqlite_profile: str = field(default_factory=lambda: os.getenv("SQLITE_PROFILE", "wal"))
+    sqlite_journal_mode: str = field(default_factory=lambda: os.getenv("SQLITE_JOURNAL_MODE", ""))
+    sqlite_synchronous: str = field(default_factory=lambda: os.getenv("SQLITE_SYNCHRONOUS", ""))
+    sqlite_cache_size: str = field(default_factory=lambda: os.getenv("SQLITE_CACHE_SIZE", ""))
+    sqlite_mmap_size: str = field(default_factory=lambda: os.getenv("SQLITE_MMAP_SIZE", ""))
+    sqlite_busy_timeout: str = field(default_factory=lambda: os.getenv("SQLITE_BUSY_TIMEOUT", ""))
+
+    # Асинхронный приём обращений: POST /contacts ставит заявку в очередь,
+    # а запись в базу идёт пачками из отдельного потока.
+    ingest_async: bool = field(default_factory=lambda: _env_bool("INGEST_ASYNC", False))
+    ingest_queue_size: int = field(default_factory=lambda: _env_int("INGEST_QUEUE_SIZE", 1000))
+    ingest_batch_size: int = field(default_factory=lambda: _env_int("INGEST_BATCH_SIZE", 100))
+    ingest_batch_wait_ms: int = field(
+        default_factory=lambda: _env_int("INGEST_BATCH_WAIT_MS", 5)
+    )
+    ingest_max_wait_ms: int = field(default_factory=lambda: _env_int("INGEST_MAX_WAIT_MS", 50))
+    ingest_tickets_limit: int = field(
+        default_factory=lambda: _env_int("INGEST_TICKETS_LIMIT", 10000)
+    )
+
+    # Ключи идемпотентности POST /contacts
+    idempotency_ttl_seconds: int = field(
+        default_factory=lambda: _env_int("IDEMPOTENCY_TTL_SECONDS", 86400)
+    )
+    idempotency_cache_size: int = field(
+        default_factory=lambda: _env_int("IDEMPOTENCY_CACHE_SIZE", 10000)
+    )
+    idempotency_sweep_interval: int = field(
+        default_factory=lambda: _env_int("IDEMPOTENCY_SWEEP_INTERVAL", 60)
+    )
+    idempotency_sweep_batch: int = field(
+        default_factory=lambda: _env_int("IDEMPOTENCY_SWEEP_BATCH", 1000)
+    )
+
+    # Архивация закрытых обращений в contacts_archive
+    archive_retention_days: int = field(
+        default_factory=lambda: _env_int("ARCHIVE_RETENTION_DAYS", 90)
+    )
+    archive_batch_size: int = field(default_factory=lambda: _env_int("ARCHIVE_BATCH_SIZE", 500))
+    archive_max_batches: int = field(
+        default_factory=lambda: _env_int("ARCHIVE_MAX_BATCHES", 100)
+    )
+    archive_interval: int = field(default_factory=lambda: _env_int("ARCHIVE_INTERVAL", 3600))
+
+    # Токен для служебных эндпоинтов /admin/* (заголовок X-Admin-Token);
+    # пока не задан, служебные эндпоинты недоступны
+    admin_token: str = field(default_factory=lambda: os.getenv("ADMIN_TOKEN", ""))
+
+    # Профилирование запросов. Пока выключено, мидлварь и обёртки не подключаются вовсе.
+    # Включённое профилирование срабатывает по заголовку `X-Profile: 1` (вместе с X-Admin-Token)
+    # или для доли запросов `PROFILING_SAMPLE_RATE`.
+    profiling_enabled: bool = field(default_factory=lambda: _env_bool("PROFILING", False))
+    profiling_sample_rate: float = field(
+        default_factory=lambda: _env_float("PROFILING_SAMPLE_RATE", 0.0)
+    )
+    profiling_dir: str = field(default_factory=lambda: os.getenv("PROFILING_DIR", "./profiles"))
+    profiling_keep: int = field(default_factory=lambda: _env_int("PROFILING_KEEP", 50))
+
+    # Кэш «лид -> последний активный оператор» для источников со sticky_routing
+    affinity_cache_size: int = field(
+        default_factory=lambda: _env_int("AFFINITY_CACHE_SIZE", 100000)
+    )
+
+    # Перераспределять активные обращения при отключении оператора или снижении max_load
+    rebalance_on_update: bool = field(
+        default_factory=lambda: _env_bool("REBALANCE_ON_UPDATE", True)
+    )
+
+    # Истечение забытых активных обращений по таймауту источника
+    expiry_interval: int = field(default_factory=lambda: _env_int("EXPIRY_INTERVAL", 60))
+    expiry_batch_size: int = field(default_factory=lambda: _env_int("EXPIRY_BATCH_SIZE", 500))
+
+    # Кэш сериализованных ответов GET, отдаваемых по ETag
+    etag_cache_size: int = field(default_factory=lambda: _env_int("ETAG_CACHE_SIZE", 256))
+
+    # Сжатие ответов gzip (если клиент присылает Accept-Encoding: gzip) от этого размера
+    gzip_enabled: bool = field(default_factory=lambda: _env_bool("GZIP", True))
+    gzip_min_size: int = field(default_factory=lambda: _env_int("GZIP_MIN_SIZE", 1000))
+
+    # Допуск обращений по источникам (лимиты задаются у источника)
+    admission_refresh_interval: int = field(
+        default_factory=lambda: _env_int("ADMISSION_REFRESH_INTERVAL", 10)
+    )
+    admission_park_interval: float = field(
+        default_factory=lambda: _env_float("ADMISSION_PARK_INTERVAL", 0.2)
+    )
+    admission_park_batch: int = field(
+        default_factory=lambda: _env_int("ADMISSION_PARK_BATCH", 500)
+    )
+    admission_park_queue_size: int = field(
+        default_factory=lambda: _env_int("ADMISSION_PARK_QUEUE_SIZE", 10000)
+    )
+
+    # Как часто сохранять состояние плавного round-robin источников в базу
+    wrr_checkpoint_interval: int = field(
+        default_factory=lambda: _env_int("WRR_CHECKPOINT_INTERVAL", 5)
+    )
+
+    # Старт приложения: сверка ревизии Alembic и прогрев кэшей до готовности
+    schema_check: bool = field(default_factory=lambda: _env_bool("SCHEMA_CHECK", True))
+    warmup_leads: int = field(default_factory=lambda: _env_int("WARMUP_LEADS", 10000))
+
+
+settings = Settings()
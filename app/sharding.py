@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, TypeVar
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import models
+from .database import Base, create_app_engine, sqlite_pragmas
+from .settings import Settings, settings
+
+T = TypeVar("T")
+
+# Таблицы, которые живут в файлах шардов; остальные — в глобальной базе
+SHARD_TABLES = (
+    models.Contact.__table__,
+    models.ContactArchive.__table__,
+    models.IdempotencyKey.__table__,
+    models.DataVersion.__table__,
+    # Скетчи обновляются в той же транзакции, что и обращение: в глобальной базе
+    # они снова свели бы всех писателей к одной блокировке. HLL сливаются при чтении
+    models.LeadSketch.__table__,
+)
+
+GLOBAL_SCHEMA = "global_db"
+
+
+class ShardRouter:
+    """Обращения по источникам в отдельных файлах SQLite — у каждого шарда свой писатель.
+
+    Источник живёт в шарде `source_id % N`. Операторы, лиды и источники
+    остаются в глобальной базе, которая подключается к каждому соединению шарда
+    через ATTACH: запросы и связи ORM в сессии шарда видят обе базы. id обращений
+    чередуются (`id % N` — номер шарда), поэтому по id сразу видно, где оно лежит.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        global_url: str,
+        pragmas: Optional[Dict[str, object]] = None,
+        pool_size: int = 5,
+        read_pool_size: int = 5,
+    ):
+        self.urls = list(urls)
+        if not self.urls:
+            raise ValueError("Не заданы базы шардов")
+        global_path = make_url(global_url).database
+        self.engines: List[Engine] = []
+        self.read_engines: List[Engine] = []
+        for url in self.urls:
+            engine = create_app_engine(url, pragmas, pool_size=pool_size)
+            read_engine = create_app_engine(
+                url, pragmas, read_only=True, pool_size=read_pool_size
+            )
+            for item in (engine, read_engine):
+                _attach_on_connect(item, global_path)
+            self.engines.append(engine)
+            self.read_engines.append(read_engine)
+        self.session_factories = [
+            sessionmaker(bind=engine, autoflush=False, autocommit=False)
+            for engine in self.engines
+        ]
+        self.read_session_factories = [
+            sessionmaker(bind=engine, autoflush=False, autocommit=False)
+            for engine in self.read_engines
+        ]
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.urls), thread_name_prefix="shard"
+        )
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def shard_for_source(self, source_id: int) -> int:
+        return source_id % len(self)
+
+    def shard_for_contact(self, contact_id: int) -> int:
+        return contact_id % len(self)
+
+    def session_for_source(self, source_id: int, read: bool = False) -> Session:
+        factories = self.read_session_factories if read else self.session_factories
+        return factories[self.shard_for_source(source_id)]()
+
+    def next_contact_id(self, source_id: int):
+        # Вычисляется внутри самого INSERT, так что гонок между писателями шарда нет.
+        # Архив тоже учитываем: иначе после архивации свежих обращений их id вернулись бы
+        shard = self.shard_for_source(source_id)
+        last_ids = [
+            func.coalesce(select(func.max(model.id)).scalar_subquery(), shard)
+            for model in (models.Contact, models.ContactArchive)
+        ]
+        return select(func.max(*last_ids) + len(self)).scalar_subquery()
+
+    def create_schema(self) -> None:
+        # Отдельный движок без ATTACH: иначе create_all найдёт одноимённые таблицы
+        # глобальной базы и ничего не создаст в шарде
+        for url in self.urls:
+            engine = create_engine(url)
+            try:
+                Base.metadata.create_all(bind=engine, tables=list(SHARD_TABLES))
+            finally:
+                engine.dispose()
+
+    def fan_out(self, task: Callable[[Session], T], read: bool = True) -> List[T]:
+        # Каждый шард в своём потоке и со своей сессией; порядок результатов — по шардам
+        factories = self.read_session_factories if read else self.session_factories
+
+        def run(factory) -> T:
+            db = factory()
+            try:
+                return task(db)
+            finally:
+                db.close()
+
+        return list(self._executor.map(run, factories))
+
+    def active_loads(self, operator_ids: List[int]) -> Dict[int, int]:
+        loads: Dict[int, int] = {}
+        for part in self.fan_out(lambda db: _active_loads(db, operator_ids)):
+            for operator_id, count in part.items():
+                loads[operator_id] = loads.get(operator_id, 0) + count
+        return loads
+
+    def last_active_operator(self, lead_id: int) -> Optional[int]:
+        # Лид мог писать в разные источники: берём самое свежее назначение по всем шардам
+        found = [
+            row
+            for row in self.fan_out(lambda db: _last_active_assignment(db, lead_id))
+            if row is not None
+        ]
+        if not found:
+            return None
+        return max(found, key=lambda row: (row.created_at, row.id)).operator_id
+
+    def dispose(self) -> None:
+        self._executor.shutdown(wait=True)
+        for engine in self.engines + self.read_engines:
+            engine.dispose()
+
+
+def _attach_on_connect(engine: Engine, global_path: str) -> None:
+    @event.listens_for(engine, "connect")
+    def attach_global(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"ATTACH DATABASE ? AS {GLOBAL_SCHEMA}", (global_path,))
+        finally:
+            cursor.close()
+
+
+def _active_loads(db: Session, operator_ids: List[int]) -> Dict[int, int]:
+    rows = db.execute(
+        select(models.Contact.operator_id, func.count(models.Contact.id))
+        .where(
+            models.Contact.operator_id.in_(operator_ids),
+            models.Contact.is_active.is_(True),
+        )
+        .group_by(models.Contact.operator_id)
+    ).all()
+    return dict(rows)
+
+
+def _last_active_assignment(db: Session, lead_id: int):
+    return db.execute(
+        select(models.Contact.id, models.Contact.created_at, models.Contact.operator_id)
+        .where(
+            models.Contact.lead_id == lead_id,
+            models.Contact.is_active.is_(True),
+            models.Contact.operator_id.is_not(None),
+        )
+        .order_by(models.Contact.id.desc())
+        .limit(1)
+    ).first()
+
+
+def router_from_settings(config: Settings) -> Optional[ShardRouter]:
+    urls = [url.strip() for url in config.shard_database_urls.split(",") if url.strip()]
+    if not urls:
+        return None
+    return ShardRouter(
+        urls,
+        config.database_url,
+        pragmas=sqlite_pragmas(config),
+        pool_size=config.db_pool_size,
+        read_pool_size=config.db_read_pool_size,
+    )
+
+
+# None — шардирование выключено, все таблицы в одной базе
+router = router_from_settings(settings)
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import select
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.orm import Session, configure_mappers
+
+from . import affinity, idempotency, models, services, sharding, wrr
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).resolve().parents[1] / "alembic.ini"
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def check_schema(engine: Engine, config_path: Path = ALEMBIC_INI) -> str:
+    # Таблицы создаёт только Alembic; здесь лишь сверяем ревизию базы с head
+    config = Config(str(config_path))
+    config.set_main_option("script_location", str(Path(config_path).parent / "alembic"))
+    head = ScriptDirectory.from_config(config).get_current_head()
+    with engine.connect() as conn:
+        current = MigrationContext.configure(conn).get_current_revision()
+    if current != head:
+        raise SchemaOutdated(
+            f"Схема базы на ревизии {current}, ожидается {head}: выполните `alembic upgrade head`"
+        )
+    return head
+
+
+def warm_up(
+    db: Session,
+    idempotency_store: idempotency.IdempotencyStore,
+    leads_limit: int = 10000,
+) -> Dict[str, int]:
+    """Прогрев горячего пути POST /contacts до приёма трафика.
+
+    Компилируем запросы распределения (маршруты источников и нагрузку операторов),
+    подтягиваем страницы SQLite в кэш и заполняем LRU: последних лидов с активными
+    операторами и непросроченные ключи идемпотентности. Пробное обращение
+    компилирует INSERT-ы горячего пути и откатывается — в базе ничего не остаётся.
+    """
+    configure_mappers()
+
+    sources = db.scalars(select(models.Source)).all()
+    for source in sources:
+        configs = services._get_available_configs_for_source(db, source.id)
+        for cfg in configs:
+            services._active_load(db, cfg.operator_id)
+    if sources:
+        contact = services.create_contact(db, sources[0].id, "__warmup__")
+        lead_id = contact.lead_id
+        db.rollback()
+        # id откатанного лида достанется следующему настоящему лиду,
+        # а пробный выбор не должен сдвигать round-robin источника
+        affinity.cache.discard(lead_id)
+        wrr.state.discard(sources[0].id)
+
+    # Сначала самые свежие обращения: у лида берём только последнего оператора.
+    # С шардами обращения и ключи лежат в файлах шардов, а не в глобальной базе
+    if sharding.router is None:
+        rows = _recent_assignments(db, leads_limit)
+        keys = _live_keys(db, idempotency_store.cache_size)
+    else:
+        rows = _merge_shards(
+            sharding.router.fan_out(lambda shard_db: _recent_assignments(shard_db, leads_limit)),
+            key=lambda row: (row.created_at, row.id),
+            limit=leads_limit,
+        )
+        keys = _merge_shards(
+            sharding.router.fan_out(
+                lambda shard_db: _live_keys(shard_db, idempotency_store.cache_size)
+            ),
+            key=lambda row: row.expires_at,
+            limit=idempotency_store.cache_size,
+        )
+
+    recent: Dict[int, int] = {}
+    for row in rows:
+        recent.setdefault(row.lead_id, row.operator_id)
+    # Старые кладём первыми, чтобы свежие оказались в хвосте LRU
+    for lead_id, operator_id in reversed(list(recent.items())):
+        affinity.cache.set(lead_id, operator_id)
+
+    for key, contact_id, expires_at in reversed(keys):
+        idempotency_store.remember(key, contact_id, expires_at)
+
+    db.rollback()
+    return {"sources": len(sources), "leads": len(recent), "idempotency_keys": len(keys)}
+
+
+def _recent_assignments(db: Session, limit: int) -> List[Row]:
+    return db.execute(
+        select(
+            models.Contact.lead_id,
+            models.Contact.operator_id,
+            models.Contact.created_at,
+            models.Contact.id,
+        )
+        .where(
+            models.Contact.is_active.is_(True),
+            models.Contact.operator_id.is_not(None),
+        )
+        .order_by(models.Contact.id.desc())
+        .limit(limit)
+    ).all()
+
+
+def _live_keys(db: Session, limit: int) -> List[Row]:
+    return db.execute(
+        select(
+            models.IdempotencyKey.key,
+            models.IdempotencyKey.contact_id,
+            models.IdempotencyKey.expires_at,
+        )
+        .where(models.IdempotencyKey.expires_at > idempotency._utcnow())
+        .order_by(models.IdempotencyKey.expires_at.desc())
+        .limit(limit)
+    ).all()
+
+
+def _merge_shards(parts: List[List[Row]], key: Callable[[Row], Any], limit: int) -> List[Row]:
+    # Каждый шард уже отдал свои самые свежие строки: общий топ — среди них
+    rows = [row for part in parts for row in part]
+    rows.sort(key=key, reverse=True)
+    return rows[:limit]
+
+
+class Readiness:
+    """Готовность принимать трафик: выставляется после прогрева, снимается при остановке."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self.reason: Optional[str] = "starting"
+        self.warmup: Dict[str, int] = {}
+        self.warmup_seconds: Optional[float] = None
+
+    def run_warm_up(self, session_factory, idempotency_store, leads_limit: int) -> None:
+        started = time.perf_counter()
+        db = session_factory()
+        try:
+            warmup = warm_up(db, idempotency_store, leads_limit)
+        finally:
+            db.close()
+        elapsed = time.perf_counter() - started
+        logger.info("Прогрев завершён за %.3f с: %s", elapsed, warmup)
+        with self._lock:
+            self.warmup = warmup
+            self.warmup_seconds = elapsed
+            self.ready = True
+            self.reason = None
+
+    def mark_not_ready(self, reason: str) -> None:
+        with self._lock:
+            self.ready = False
+            self.reason = reason
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "reason": self.reason,
+                "warmup": dict(self.warmup),
+                "warmup_seconds": self.warmup_seconds,
+            }
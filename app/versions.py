@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+OPERATORS = "operators"
+SOURCES = "sources"
+CONTACTS = "contacts"
+
+
+def bump(db: Session, *entities: str) -> None:
+    # Увеличиваем версии в текущей транзакции — вместе с самим изменением
+    for entity in entities:
+        result = db.execute(
+            update(models.DataVersion)
+            .where(models.DataVersion.entity == entity)
+            .values(version=models.DataVersion.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            db.add(models.DataVersion(entity=entity, version=1))
+            db.flush()
+
+
+def read(db: Session, entities: Iterable[str]) -> Dict[str, int]:
+    entities = list(entities)
+    rows = db.execute(
+        select(models.DataVersion.entity, models.DataVersion.version).where(
+            models.DataVersion.entity.in_(entities)
+        )
+    ).all()
+    found = dict(rows)
+    return {entity: found.get(entity, 0) for entity in entities}
+
+
+def make_etag(key: str, current: Dict[str, int]) -> str:
+    # Сильный ETag: ресурс + версии всех сущностей, от которых он зависит
+    raw = key + "|" + ",".join(f"{name}:{current[name]}" for name in sorted(current))
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [item.strip() for item in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCache:
+    """Небольшой LRU готовых тел ответов по ETag (то есть по ресурсу и версиям)."""
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._data.get(etag)
+            if body is not None:
+                self._data.move_to_end(etag)
+            return body
+
+    def put(self, etag: str, body: bytes) -> None:
+        with self._lock:
+            self._data[etag] = body
+            self._data.move_to_end(etag)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,131 @@
+import threading
+from typing import Callable, Collection, Dict, Optional, Set
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+RANDOM = "random"
+SMOOTH = "smooth"
+
+
+def smooth_weighted_pick(
+    weights: Dict[int, int], current: Dict[int, int], skip: Collection[int] = ()
+) -> Optional[int]:
+    # Плавный взвешенный round-robin (как в nginx): за один проход прибавляем веса,
+    # берём максимум и вычитаем из него сумму — доли сходятся к весам без случайности.
+    # Пропущенные (перегруженные) в проходе не участвуют и сохраняют свой текущий вес
+    total = 0
+    best = None
+    for key, weight in weights.items():
+        if key in skip:
+            continue
+        current[key] = current.get(key, 0) + weight
+        total += weight
+        if best is None or current[key] > current[best]:
+            best = key
+    if best is not None:
+        current[best] -= total
+    return best
+
+
+class SmoothRoundRobin:
+    """Текущие веса плавного round-robin по источникам (`distribution_mode = "smooth"`).
+
+    Состояние живёт в памяти; `checkpoint` сохраняет изменённые источники в
+    `source_wrr_state`, а после рестарта источник поднимается из базы при первом
+    выборе. Воркеры ведут каждый свою последовательность, поэтому общие доли
+    отклоняются от весов не больше чем на несколько обращений на воркер.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: Dict[int, Dict[int, int]] = {}
+        self._dirty: Set[int] = set()
+
+    def pick(
+        self,
+        db: Session,
+        source_id: int,
+        weights: Dict[int, int],
+        skip: Collection[int] = (),
+    ) -> Optional[int]:
+        with self._lock:
+            loaded = source_id in self._current
+        if not loaded:
+            saved = _load(db, source_id)
+            with self._lock:
+                self._current.setdefault(source_id, saved)
+
+        with self._lock:
+            current = self._current[source_id]
+            # Операторы, которых больше нет в маршрутах источника, забываем
+            for key in [key for key in current if key not in weights]:
+                del current[key]
+            best = smooth_weighted_pick(weights, current, skip)
+            if best is not None:
+                self._dirty.add(source_id)
+            return best
+
+    def reset(self, source_id: int) -> None:
+        # Маршруты источника изменились — начинаем последовательность заново
+        with self._lock:
+            self._current[source_id] = {}
+            self._dirty.add(source_id)
+
+    def discard(self, source_id: int) -> None:
+        # Забыть несохранённое состояние: следующий выбор перечитает его из базы
+        with self._lock:
+            self._current.pop(source_id, None)
+            self._dirty.discard(source_id)
+
+    def checkpoint(self, session_factory: Callable[[], Session]) -> int:
+        with self._lock:
+            snapshot = {
+                source_id: dict(self._current.get(source_id, {}))
+                for source_id in self._dirty
+            }
+            self._dirty.clear()
+        if not snapshot:
+            return 0
+
+        db = session_factory()
+        try:
+            db.execute(
+                delete(models.SourceWrrState).where(
+                    models.SourceWrrState.source_id.in_(snapshot)
+                )
+            )
+            rows = [
+                {"source_id": source_id, "operator_id": operator_id, "current": value}
+                for source_id, current in snapshot.items()
+                for operator_id, value in current.items()
+            ]
+            if rows:
+                db.execute(insert(models.SourceWrrState), rows)
+            db.commit()
+        except Exception:
+            with self._lock:
+                self._dirty.update(snapshot)
+            raise
+        finally:
+            db.close()
+        return len(snapshot)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._current.clear()
+            self._dirty.clear()
+
+
+def _load(db: Session, source_id: int) -> Dict[int, int]:
+    rows = db.execute(
+        select(models.SourceWrrState.operator_id, models.SourceWrrState.current).where(
+            models.SourceWrrState.source_id == source_id
+        )
+    ).all()
+    return dict(rows)
+
+
+state = SmoothRoundRobin()
@@ -0,0 +1,126 @@
+"""Время импорта приложения и латентность первого POST /contacts.
+
+Каждый замер идёт в отдельном процессе, чтобы кэши интерпретатора, SQLAlchemy
+и SQLite были холодными. Первый запрос сравнивается с установившимся режимом
+без прогрева (lifespan не запускается) и с прогревом (`with TestClient(app)`).
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+
+ROOT = Path(__file__).resolve().parents[1]
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import app.main
+print(time.perf_counter() - started)
+"""
+
+REQUEST_SNIPPET = """
+import json, sys, time
+from fastapi.testclient import TestClient
+from app.main import app
+
+warm = sys.argv[1] == "warm"
+source_id = int(sys.argv[2])
+
+
+def measure(client):
+    timings = []
+    for i in range(200):
+        started = time.perf_counter()
+        client.post("/contacts", json={"lead_external_id": f"lead-{i}", "source_id": source_id})
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+if warm:
+    with TestClient(app) as client:
+        timings = measure(client)
+else:
+    timings = measure(TestClient(app))
+print(json.dumps(timings))
+"""
+
+
+def _migrated_db(directory: str) -> str:
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    config = Config()
+    config.set_main_option("script_location", str(ROOT / "alembic"))
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "head")
+    return url
+
+
+def _seed(env) -> int:
+    snippet = """
+from app import models
+from app.database import SessionLocal
+db = SessionLocal()
+source = models.Source(name="bench", code="bench")
+db.add(source)
+db.flush()
+for i in range(5):
+    op = models.Operator(name=f"op-{i}", max_load=1000000)
+    db.add(op)
+    db.flush()
+    db.add(models.SourceOperatorConfig(source_id=source.id, operator_id=op.id, weight=i + 1))
+db.commit()
+print(source.id)
+"""
+    return int(_run(snippet, env))
+
+
+def _run(snippet: str, env, *args: str) -> str:
+    result = subprocess.run(
+        [sys.executable, "-c", snippet, *args],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=_migrated_db(tmp), PYTHONDONTWRITEBYTECODE="1")
+        source_id = _seed(env)
+
+        imports = [float(_run(IMPORT_SNIPPET, env)) for _ in range(args.runs)]
+        print(
+            f"import app.main: median {statistics.median(imports) * 1000:.1f} ms, "
+            f"max {max(imports) * 1000:.1f} ms"
+        )
+
+        for mode in ("cold", "warm"):
+            first, steady = [], []
+            for _ in range(args.runs):
+                timings = json.loads(_run(REQUEST_SNIPPET, env, mode, str(source_id)))
+                first.append(timings[0])
+                steady.append(statistics.median(timings[1:]))
+            print(
+                f"POST /contacts ({mode}): first {statistics.median(first) * 1000:.1f} ms, "
+                f"steady median {statistics.median(steady) * 1000:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Сравнение профилей SQLite под конкурентной нагрузкой.
+
+Для каждого профиля создаётся чистая файловая база, после чего несколько
+потоков-писателей создают обращения через `services.create_contact`, а потоки-
+читатели параллельно гоняют агрегат по нагрузке операторов (как в статистике).
+
+    python -m benchmarks.bench_storage --seconds 5 --writers 4 --readers 4
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app import affinity, models, services
+from app.database import SQLITE_PROFILES, Base, create_app_engine
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _seed(session_factory, operators: int) -> int:
+    db = session_factory()
+    try:
+        source = models.Source(name="bench", code="bench")
+        db.add(source)
+        db.flush()
+        for i in range(operators):
+            operator = models.Operator(name=f"op-{i}", max_load=1_000_000)
+            db.add(operator)
+            db.flush()
+            db.add(
+                models.SourceOperatorConfig(
+                    source_id=source.id, operator_id=operator.id, weight=i + 1
+                )
+            )
+        db.commit()
+        return source.id
+    finally:
+        db.close()
+
+
+def _writer(session_factory, source_id, stop, latencies, errors, prefix):
+    n = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        db = session_factory()
+        try:
+            services.create_contact(db, source_id, f"{prefix}-{n % 500}")
+            db.commit()
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            db.rollback()
+            errors.append(1)
+        finally:
+            db.close()
+        n += 1
+
+
+def _reader(session_factory, stop, latencies, errors):
+    while not stop.is_set():
+        started = time.perf_counter()
+        db = session_factory()
+        try:
+            (
+                db.query(models.Contact.operator_id, func.count(models.Contact.id))
+                .filter(models.Contact.is_active.is_(True))
+                .group_by(models.Contact.operator_id)
+                .all()
+            )
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors.append(1)
+        finally:
+            db.close()
+
+
+def run_profile(profile: str, args) -> Dict[str, object]:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        pragmas = SQLITE_PROFILES[profile]
+        pool = args.writers + args.readers
+        engine = create_app_engine(url, pragmas=pragmas, pool_size=pool)
+        read_engine = create_app_engine(url, pragmas=pragmas, read_only=True, pool_size=pool)
+        Base.metadata.create_all(bind=engine)
+        write_factory = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+        read_factory = sessionmaker(bind=read_engine, autoflush=False, autocommit=False)
+        source_id = _seed(write_factory, args.operators)
+        affinity.cache.clear()
+
+        stop = threading.Event()
+        write_lat: List[float] = []
+        read_lat: List[float] = []
+        write_err: List[int] = []
+        read_err: List[int] = []
+        threads = [
+            threading.Thread(
+                target=_writer,
+                args=(write_factory, source_id, stop, write_lat, write_err, f"w{i}"),
+            )
+            for i in range(args.writers)
+        ] + [
+            threading.Thread(target=_reader, args=(read_factory, stop, read_lat, read_err))
+            for _ in range(args.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+        read_engine.dispose()
+
+    return {
+        "profile": profile,
+        "writes_per_s": len(write_lat) / args.seconds,
+        "write_p50_ms": _percentile(write_lat, 50) * 1000,
+        "write_p95_ms": _percentile(write_lat, 95) * 1000,
+        "write_errors": len(write_err),
+        "reads_per_s": len(read_lat) / args.seconds,
+        "read_p50_ms": _percentile(read_lat, 50) * 1000,
+        "read_p95_ms": _percentile(read_lat, 95) * 1000,
+        "read_errors": len(read_err),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES))
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--operators", type=int, default=5)
+    args = parser.parse_args()
+
+    columns = [
+        "profile", "writes_per_s", "write_p50_ms", "write_p95_ms", "write_errors",
+        "reads_per_s", "read_p50_ms", "read_p95_ms", "read_errors",
+    ]
+    print(" ".join(f"{c:>13}" for c in columns))
+    for profile in args.profiles:
+        row = run_profile(profile, args)
+        print(
+            " ".join(
+                f"{row[c]:>13.1f}" if isinstance(row[c], float) else f"{row[c]:>13}"
+                for c in columns
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
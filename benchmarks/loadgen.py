@@ -0,0 +1,356 @@
+"""Нагрузка на запущенный экземпляр по HTTP: синтетический трафик или повтор записи.
+
+В отличие от остальных бенчмарков, приложение здесь не запускается в процессе: запросы идут
+через async httpx в настоящий uvicorn (с его воркерами, пулом соединений и базой).
+Нагрузка открытая — запросы отправляются по расписанию с заданной частотой, а
+задержка считается от запланированного момента, так что очередь на стороне
+клиента (нехватка `--concurrency`) тоже попадает в перцентили.
+
+Синтетический режим смешивает `POST /contacts` (часть лидов повторяется, источники
+выбираются по Zipf) с чтениями дашборда (с If-None-Match, как браузер):
+
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --setup \\
+        --rate 200 --concurrency 64 --duration 30 --record traffic.ndjson
+
+Повтор записанного трафика (по меткам `t`, ускорение `--speed`):
+
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --replay traffic.ndjson
+
+Строка NDJSON: `{"t": 0.125, "method": "POST", "path": "/contacts", "json": {...}}`
+(`t` — секунды от начала, `json` и `headers` необязательны). В конце печатаются
+пропускная способность, перцентили задержек, ошибки по кодам и распределение
+новых обращений по операторам в сравнении с настроенными весами.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+import httpx
+
+from .bench_storage import _percentile
+
+# Чтения дашборда и их относительная частота
+DASHBOARD_READS = [
+    ("/stats/operators", 4),
+    ("/sources", 2),
+    ("/stats/unique-leads?group_by=source", 2),
+    ("/stats/admission", 1),
+    ("/leads", 1),
+]
+
+
+@dataclass
+class Planned:
+    t: float
+    method: str
+    path: str
+    json: Optional[Dict[str, Any]] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def kind(self) -> str:
+        return f"{self.method} {self.path.split('?')[0]}"
+
+    def to_record(self) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"t": round(self.t, 6), "method": self.method, "path": self.path}
+        if self.json is not None:
+            record["json"] = self.json
+        if self.headers:
+            record["headers"] = self.headers
+        return record
+
+
+def _zipf_weights(count: int, skew: float) -> List[float]:
+    return [1 / (rank**skew) for rank in range(1, count + 1)]
+
+
+def synthetic(
+    source_ids: List[int],
+    rate: float,
+    duration: float,
+    repeat_ratio: float,
+    read_ratio: float,
+    skew: float,
+    seed: Optional[int],
+) -> Iterator[Planned]:
+    rnd = random.Random(seed)
+    source_weights = _zipf_weights(len(source_ids), skew)
+    read_paths = [path for path, _ in DASHBOARD_READS]
+    read_weights = [weight for _, weight in DASHBOARD_READS]
+    run_id = f"{int(time.time()):x}"
+    leads = 0
+    t = 0.0
+    while True:
+        # Пуассоновский поток: интервалы между запросами экспоненциальные
+        t += rnd.expovariate(rate)
+        if t >= duration:
+            return
+        if rnd.random() < read_ratio:
+            yield Planned(t, "GET", rnd.choices(read_paths, read_weights)[0])
+            continue
+        if leads and rnd.random() < repeat_ratio:
+            lead = rnd.randrange(leads)
+        else:
+            lead = leads
+            leads += 1
+        source_id = rnd.choices(source_ids, source_weights)[0]
+        yield Planned(
+            t,
+            "POST",
+            "/contacts",
+            json={
+                "lead_external_id": f"load-{run_id}-{lead}",
+                "source_id": source_id,
+                "message": "loadgen",
+            },
+        )
+
+
+def replay(stream: TextIO, rate: float, speed: float) -> Iterator[Planned]:
+    for index, line in enumerate(stream):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        # Без меток времени запросы идут равномерно с частотой --rate
+        t = record["t"] / speed if "t" in record else index / rate
+        yield Planned(
+            t,
+            record.get("method", "GET").upper(),
+            record["path"],
+            json=record.get("json"),
+            headers=record.get("headers", {}),
+        )
+
+
+@dataclass
+class Result:
+    kind: str
+    status: int
+    latency: float
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    planned: Planned,
+    started: float,
+    limit: asyncio.Semaphore,
+    etags: Dict[str, str],
+    results: List[Result],
+) -> None:
+    async with limit:
+        headers = dict(planned.headers)
+        if planned.method == "GET" and planned.path in etags:
+            headers.setdefault("If-None-Match", etags[planned.path])
+        try:
+            response = await client.request(
+                planned.method, planned.path, json=planned.json, headers=headers
+            )
+            status = response.status_code
+            if planned.method == "GET" and "etag" in response.headers:
+                etags[planned.path] = response.headers["etag"]
+        except httpx.HTTPError:
+            status = 0
+    results.append(Result(planned.kind, status, time.perf_counter() - started - planned.t))
+
+
+async def drive(
+    url: str,
+    plan: Iterator[Planned],
+    concurrency: int,
+    timeout: float,
+    record: Optional[TextIO] = None,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> tuple:
+    # transport — для прогона без сети (например, httpx.ASGITransport в тестах)
+    results: List[Result] = []
+    etags: Dict[str, str] = {}
+    limit = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=url, timeout=timeout, limits=limits, transport=transport
+    ) as client:
+        tasks = set()
+        started = time.perf_counter()
+        for planned in plan:
+            if record is not None:
+                record.write(json.dumps(planned.to_record(), ensure_ascii=False) + "\n")
+            delay = planned.t - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(_send(client, planned, started, limit, etags, results))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def setup_instance(client: httpx.Client, sources: int, operators: int) -> List[int]:
+    # Свои операторы и источники с разными весами, чтобы было с чем сравнивать
+    prefix = f"load-{int(time.time()):x}"
+    operator_ids = []
+    for i in range(operators):
+        response = client.post(
+            "/operators", json={"name": f"{prefix}-op{i}", "max_load": 1_000_000}
+        )
+        response.raise_for_status()
+        operator_ids.append(response.json()["id"])
+    source_ids = []
+    for i in range(sources):
+        response = client.post(
+            "/sources", json={"name": f"{prefix}-src{i}", "code": f"{prefix}-{i}"}
+        )
+        response.raise_for_status()
+        source_id = response.json()["id"]
+        client.put(
+            f"/sources/{source_id}/operators",
+            json=[
+                {"operator_id": operator_id, "weight": weight}
+                for weight, operator_id in enumerate(operator_ids, start=1)
+            ],
+        ).raise_for_status()
+        source_ids.append(source_id)
+    return source_ids
+
+
+def operator_counts(client: httpx.Client) -> Dict[tuple, int]:
+    counts = {}
+    for item in client.get("/stats/operators").json():
+        for source in item["sources"]:
+            counts[(source["source_id"], item["operator_id"])] = source["contacts_count"]
+    return counts
+
+
+def source_weights(client: httpx.Client, source_ids) -> Dict[int, Dict[int, int]]:
+    weights = {}
+    for source_id in source_ids:
+        detail = client.get(f"/sources/{source_id}").json()
+        weights[source_id] = {op["operator_id"]: op["weight"] for op in detail["operators"]}
+    return weights
+
+
+def report(results: List[Result], elapsed: float) -> None:
+    total = len(results)
+    print(f"запросов: {total} за {elapsed:.1f} с — {total / elapsed:.1f} req/s")
+    by_kind: Dict[str, List[Result]] = defaultdict(list)
+    for result in results:
+        by_kind[result.kind].append(result)
+    print(f"{'запрос':<36}{'кол-во':>8}{'p50 мс':>9}{'p90 мс':>9}{'p99 мс':>9}{'max мс':>9}")
+    for kind, items in sorted(by_kind.items()):
+        latencies = [item.latency * 1000 for item in items]
+        print(
+            f"{kind:<36}{len(items):>8}"
+            f"{_percentile(latencies, 50):>9.1f}{_percentile(latencies, 90):>9.1f}"
+            f"{_percentile(latencies, 99):>9.1f}{max(latencies):>9.1f}"
+        )
+    statuses = Counter(result.status for result in results)
+    errors = sum(count for status, count in statuses.items() if status == 0 or status >= 400)
+    print(f"ошибки: {errors} ({errors / max(total, 1):.1%})")
+    print(
+        "коды ответов: "
+        + ", ".join(
+            f"{status or 'сеть'}={count}" for status, count in sorted(statuses.items())
+        )
+    )
+
+
+def report_spread(
+    before: Dict[tuple, int], after: Dict[tuple, int], weights: Dict[int, Dict[int, int]]
+) -> None:
+    # Сравниваем только обращения, назначенные за время прогона
+    print("распределение новых обращений по операторам (доля факт / по весам):")
+    for source_id, source_weights_ in sorted(weights.items()):
+        assigned = {
+            operator_id: after.get((source_id, operator_id), 0)
+            - before.get((source_id, operator_id), 0)
+            for operator_id in source_weights_
+        }
+        total = sum(assigned.values())
+        weight_total = sum(w for w in source_weights_.values() if w > 0)
+        if not total or not weight_total:
+            continue
+        worst = 0.0
+        parts = []
+        for operator_id, weight in sorted(source_weights_.items()):
+            actual = assigned[operator_id] / total
+            expected = max(weight, 0) / weight_total
+            worst = max(worst, abs(actual - expected))
+            parts.append(f"op{operator_id} {actual:.1%}/{expected:.1%}")
+        print(f"  источник {source_id} ({total}): {', '.join(parts)}; макс. отклонение {worst:.1%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rate", type=float, default=100, help="запросов в секунду")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="секунд")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="доля повторных лидов")
+    parser.add_argument("--read-ratio", type=float, default=0.1, help="доля чтений дашборда")
+    parser.add_argument("--skew", type=float, default=1.1, help="показатель Zipf по источникам")
+    parser.add_argument("--sources", type=int, nargs="*", help="id источников (по умолчанию все)")
+    parser.add_argument(
+        "--setup",
+        action="store_true",
+        help="создать свои источники и операторов с весами 1..N",
+    )
+    parser.add_argument("--setup-sources", type=int, default=3)
+    parser.add_argument("--setup-operators", type=int, default=4)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--replay", help="NDJSON с записанным трафиком")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение повтора")
+    parser.add_argument("--record", help="записать сгенерированный трафик в NDJSON")
+    args = parser.parse_args()
+
+    with httpx.Client(base_url=args.url, timeout=args.timeout) as client:
+        if args.setup:
+            source_ids = setup_instance(client, args.setup_sources, args.setup_operators)
+        elif args.sources:
+            source_ids = args.sources
+        else:
+            source_ids = [source["id"] for source in client.get("/sources").json()]
+        before = operator_counts(client)
+
+    record = open(args.record, "w", encoding="utf-8") if args.record else None
+    replay_file = open(args.replay, encoding="utf-8") if args.replay else None
+    try:
+        if replay_file is not None:
+            plan = replay(replay_file, args.rate, args.speed)
+        else:
+            if not source_ids:
+                parser.error("на экземпляре нет источников: используйте --setup")
+            plan = synthetic(
+                source_ids,
+                args.rate,
+                args.duration,
+                args.repeat_ratio,
+                args.read_ratio,
+                args.skew,
+                args.seed,
+            )
+        results, elapsed = asyncio.run(
+            drive(args.url, plan, args.concurrency, args.timeout, record)
+        )
+    finally:
+        for stream in (record, replay_file):
+            if stream is not None:
+                stream.close()
+
+    report(results, elapsed)
+    with httpx.Client(base_url=args.url, timeout=args.timeout) as client:
+        after = operator_counts(client)
+        touched = {source_id for source_id, _ in after} | set(source_ids)
+        report_spread(before, after, source_weights(client, sorted(touched)))
+
+
+if __name__ == "__main__":
+    main()
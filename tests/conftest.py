@@ -0,0 +1,75 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import affinity, wrr
+from app.database import Base
+from app.main import app, get_db, get_read_db, response_cache
+from app.settings import settings
+
+
+@pytest.fixture()
+def db_engine():
+    # Своя база на каждый тест; файлы с фоновыми потоками и шардами переопределяют фикстуру
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture()
+def session_factory(db_engine):
+    return sessionmaker(bind=db_engine, autoflush=False, autocommit=False)
+
+
+@pytest.fixture()
+def app_settings():
+    # Настройки на время теста: файл переопределяет фикстуру своим словарём
+    return {}
+
+
+def _reset_caches():
+    affinity.cache.clear()
+    wrr.state.clear()
+    response_cache.clear()
+
+
+@pytest.fixture()
+def client(session_factory, app_settings, monkeypatch):
+    for name, value in app_settings.items():
+        monkeypatch.setattr(settings, name, value)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # Кэши процесса общие для всех тестов: прошлый тест не должен влиять на распределение
+    _reset_caches()
+    previous = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+    app.dependency_overrides.update(previous)
+    _reset_caches()
+
+
+@pytest.fixture()
+def statements(db_engine):
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", capture)
+    yield captured
+    event.remove(db_engine, "before_cursor_execute", capture)
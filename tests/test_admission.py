@@ -0,0 +1,115 @@
+import pytest
+
+from app import admission, idempotency
+from app.main import app, get_admission, get_idempotency_store, get_parking_buffer
+
+
+@pytest.fixture()
+def client(client, session_factory):
+    controller = admission.AdmissionController()
+    store = idempotency.IdempotencyStore()
+    buffer = admission.ParkingBuffer(
+        session_factory, batch_size=2, max_size=3, idempotency_store=store
+    )
+    app.dependency_overrides[get_admission] = lambda: controller
+    app.dependency_overrides[get_parking_buffer] = lambda: buffer
+    app.dependency_overrides[get_idempotency_store] = lambda: store
+    return client, controller, buffer
+
+
+def _setup(client, **limits):
+    op = client.post("/operators", json={"name": "op", "max_load": 100}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "B", **limits}).json()
+    client.put(
+        f"/sources/{source['id']}/operators", json=[{"operator_id": op["id"], "weight": 1}]
+    )
+    return source["id"]
+
+
+def _post(client, lead, source_id, **kwargs):
+    return client.post(
+        "/contacts", json={"lead_external_id": lead, "source_id": source_id}, **kwargs
+    )
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = admission.TokenBucket(rate=2, burst=2)
+    now = bucket.updated_at
+    assert bucket.try_acquire(now) == (True, 0.0)
+    assert bucket.try_acquire(now)[0]
+    ok, retry_after = bucket.try_acquire(now)
+    assert not ok and retry_after == pytest.approx(0.5)
+    assert bucket.try_acquire(now + 0.5)[0]
+
+
+def test_over_limit_is_rejected_with_retry_after(client):
+    client, _, _ = client
+    source_id = _setup(client, rate_limit=0.01, rate_burst=2)
+
+    assert [_post(client, f"lead-{i}", source_id).status_code for i in range(2)] == [201, 201]
+    rejected = _post(client, "lead-3", source_id)
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+
+    # Лимит снимается PATCH'ем сразу, без ожидания периодического обновления
+    client.patch(f"/sources/{source_id}", json={"rate_limit": 1000})
+    assert _post(client, "lead-3", source_id).status_code == 201
+
+    stats = client.get("/stats/admission").json()
+    assert stats[0]["accepted"] == 3
+    assert stats[0]["rejected"] == 1
+
+
+def test_parked_contacts_are_written_unassigned(client):
+    client, _, buffer = client
+    source_id = _setup(client, rate_limit=0.01, rate_burst=1, overflow_mode="park")
+
+    assert _post(client, "lead-0", source_id).status_code == 201
+    parked = [_post(client, f"lead-{i}", source_id) for i in range(1, 5)]
+    assert [r.status_code for r in parked] == [202, 202, 202, 429]
+    assert parked[0].json() == {
+        "status": "parked",
+        "source_id": source_id,
+        "lead_external_id": "lead-1",
+    }
+
+    assert buffer.flush() == 3
+    assert len(buffer) == 0
+    contacts = [c for lead in client.get("/leads").json() for c in lead["contacts"]]
+    assert len(contacts) == 4
+    assert sum(1 for c in contacts if c["operator"] is None) == 3
+
+    stats = client.get("/stats/admission").json()[0]
+    assert (stats["accepted"], stats["parked"], stats["rejected"]) == (1, 3, 1)
+    unique = client.get(f"/stats/unique-leads?group_by=source&source_id={source_id}")
+    assert unique.json() == [{"source_id": source_id, "unique_leads": 4}]
+
+
+def test_parked_retries_with_idempotency_key_create_one_contact(client):
+    client, _, buffer = client
+    source_id = _setup(client, rate_limit=0.01, rate_burst=1, overflow_mode="park")
+
+    # Ключ принятого запроса уже в LRU: повтор отдаётся сразу, токен не нужен
+    headers = {"Idempotency-Key": "k1"}
+    first = _post(client, "lead-1", source_id, headers=headers)
+    replay = _post(client, "lead-1", source_id, headers=headers)
+    assert (first.status_code, replay.status_code) == (201, 201)
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json()["id"] == first.json()["id"]
+
+    # Сверх лимита повторы паркуются, но записывается только один
+    headers = {"Idempotency-Key": "k2"}
+    statuses = [_post(client, "lead-2", source_id, headers=headers).status_code for _ in range(3)]
+    assert statuses == [202, 202, 202]
+    buffer.flush()
+    buffer.add(admission.ParkedContact(source_id, "lead-2", None, None, "k2"))
+    buffer.flush()
+
+    leads = {lead["external_id"]: lead for lead in client.get("/leads").json()}
+    assert len(leads["lead-1"]["contacts"]) == 1
+    assert len(leads["lead-2"]["contacts"]) == 1
+
+    # После записи ключ известен: повтор отдаёт припаркованный контакт
+    replay = _post(client, "lead-2", source_id, headers=headers)
+    assert replay.status_code == 201
+    assert replay.json()["id"] == leads["lead-2"]["contacts"][0]["id"]
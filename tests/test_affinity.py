@@ -0,0 +1,74 @@
+from app import affinity
+
+
+def _setup(client, op1_load=10):
+    op1 = client.post("/operators", json={"name": "op1", "max_load": op1_load}).json()
+    op2 = client.post("/operators", json={"name": "op2", "max_load": 10}).json()
+    src_a = client.post("/sources", json={"name": "botA", "code": "A"}).json()
+    src_b = client.post(
+        "/sources", json={"name": "botB", "code": "B", "sticky_routing": True}
+    ).json()
+    client.put(
+        f"/sources/{src_a['id']}/operators",
+        json=[{"operator_id": op1["id"], "weight": 1}],
+    )
+    client.put(
+        f"/sources/{src_b['id']}/operators",
+        json=[{"operator_id": op2["id"], "weight": 1}],
+    )
+    return op1["id"], op2["id"], src_a["id"], src_b["id"]
+
+
+def _contact(client, lead, source_id):
+    rc = client.post("/contacts", json={"lead_external_id": lead, "source_id": source_id})
+    assert rc.status_code == 201
+    operator = rc.json()["operator"]
+    return operator["id"] if operator else None
+
+
+def test_returning_lead_sticks_to_last_operator(client):
+    op1, op2, src_a, src_b = _setup(client)
+
+    assert _contact(client, "lead-1", src_a) == op1
+    # Из другого бота лид попадает к тому же оператору
+    assert _contact(client, "lead-1", src_b) == op1
+    # Новый лид в sticky-источнике идёт по обычным весам
+    assert _contact(client, "lead-2", src_b) == op2
+
+    # После сброса кэша оператор берётся из contacts
+    affinity.cache.clear()
+    assert _contact(client, "lead-1", src_b) == op1
+
+
+def test_sticky_falls_back_when_operator_full_or_disabled(client):
+    op1, op2, src_a, src_b = _setup(client, op1_load=1)
+
+    assert _contact(client, "lead-1", src_a) == op1
+    assert _contact(client, "lead-1", src_b) == op2
+
+    _contact(client, "lead-3", src_b)
+    client.patch(f"/operators/{op2}", json={"active": False})
+    assert _contact(client, "lead-1", src_b) is None
+
+
+def test_sticky_routing_toggled_via_patch(client):
+    op1, op2, src_a, src_b = _setup(client)
+    rc = client.patch(f"/sources/{src_b}", json={"sticky_routing": False})
+    assert rc.status_code == 200
+    assert rc.json()["sticky_routing"] is False
+
+    assert _contact(client, "lead-1", src_a) == op1
+    assert _contact(client, "lead-1", src_b) == op2
+
+
+def test_patch_rejects_null_for_required_fields(client):
+    _, _, _, src_b = _setup(client)
+    for field in ("name", "sticky_routing", "overflow_mode", "distribution_mode"):
+        rc = client.patch(f"/sources/{src_b}", json={field: None})
+        assert rc.status_code == 422, field
+
+    # Необязательные поля по-прежнему сбрасываются в null
+    rc = client.patch(f"/sources/{src_b}", json={"code": None})
+    assert rc.status_code == 200
+    assert rc.json()["code"] is None
+    assert rc.json()["sticky_routing"] is True
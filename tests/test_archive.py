@@ -0,0 +1,112 @@
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select, update
+
+from app import models
+
+
+@pytest.fixture()
+def app_settings():
+    return {"admin_token": "secret", "archive_retention_days": 30, "archive_batch_size": 2}
+
+
+def _create_contacts(client, count):
+    op = client.post("/operators", json={"name": "op", "max_load": 100}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+    client.put(
+        f"/sources/{source['id']}/operators",
+        json=[{"operator_id": op["id"], "weight": 1}],
+    )
+    return [
+        client.post(
+            "/contacts",
+            json={"lead_external_id": "lead-1", "source_id": source["id"]},
+        ).json()["id"]
+        for _ in range(count)
+    ]
+
+
+def _age_and_close(session_factory, contact_ids, days):
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    db = session_factory()
+    try:
+        db.execute(
+            update(models.Contact)
+            .where(models.Contact.id.in_(contact_ids))
+            .values(is_active=False, created_at=created_at)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_archive_moves_only_old_closed_contacts(client, session_factory):
+    ids = _create_contacts(client, 6)
+    _age_and_close(session_factory, ids[:3], days=60)  # в архив
+    _age_and_close(session_factory, ids[3:4], days=1)  # закрыт, но свежий
+
+    assert client.post("/admin/archive").status_code == 403
+    rc = client.post("/admin/archive", headers={"X-Admin-Token": "secret"})
+    assert rc.status_code == 200
+    assert rc.json() == {"archived": 3}
+
+    db = session_factory()
+    try:
+        hot_ids = db.scalars(select(models.Contact.id).order_by(models.Contact.id)).all()
+        archived = db.scalar(select(func.count()).select_from(models.ContactArchive))
+    finally:
+        db.close()
+    assert hot_ids == ids[3:]
+    assert archived == 3
+
+    # Повторный запуск ничего не переносит
+    rc = client.post("/admin/archive", headers={"X-Admin-Token": "secret"})
+    assert rc.json() == {"archived": 0}
+
+
+def test_read_endpoints_include_archived_on_request(client, session_factory):
+    ids = _create_contacts(client, 4)
+    _age_and_close(session_factory, ids[:2], days=60)
+    client.post("/admin/archive", headers={"X-Admin-Token": "secret"})
+
+    leads = client.get("/leads").json()
+    assert [c["id"] for c in leads[0]["contacts"]] == ids[2:]
+
+    leads = client.get("/leads?include_archived=true").json()
+    contacts = leads[0]["contacts"]
+    assert [c["id"] for c in contacts] == ids
+    assert [c["archived"] for c in contacts] == [True, True, False, False]
+    assert contacts[0]["source"]["name"] == "bot"
+
+    rc = client.get("/contacts/export?include_archived=true")
+    assert rc.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(rc.text)))
+    assert [int(r["id"]) for r in rows] == ids
+    assert rows[0]["lead_external_id"] == "lead-1"
+
+    rows = list(csv.DictReader(io.StringIO(client.get("/contacts/export").text)))
+    assert [int(r["id"]) for r in rows] == ids[2:]
+
+
+def test_ids_are_not_reused_after_archiving_newest(client, session_factory):
+    ids = _create_contacts(client, 2)
+    _age_and_close(session_factory, ids, days=60)
+    assert client.post("/admin/archive", headers={"X-Admin-Token": "secret"}).json() == {
+        "archived": 2
+    }
+
+    # Горячая таблица пуста, но новый id не должен совпасть с архивным
+    new_id = client.post(
+        "/contacts", json={"lead_external_id": "lead-1", "source_id": 1}
+    ).json()["id"]
+    assert new_id > max(ids)
+
+    _age_and_close(session_factory, [new_id], days=60)
+    rc = client.post("/admin/archive", headers={"X-Admin-Token": "secret"})
+    assert rc.json() == {"archived": 1}
+
+    leads = client.get("/leads?include_archived=true").json()
+    assert [c["id"] for c in leads[0]["contacts"]] == [*ids, new_id]
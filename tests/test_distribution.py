@@ -6,8 +6,9 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+from app import wrr
 from app.database import Base
-from app.main import app, get_db
+from app.main import app, get_db, get_read_db
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -29,6 +30,7 @@ def override_get_db():
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 client = TestClient(app)
 
@@ -37,7 +39,9 @@ client = TestClient(app)
 def reset_db():
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    wrr.state.clear()
     yield
+    wrr.state.clear()
 
 
 def test_weighted_distribution_and_limits():
@@ -149,3 +153,64 @@ def test_max_load_respected():
     assert counts[op2["id"]] <= 1
     # часть обращений должна остаться без оператора из-за лимитов
     assert unassigned > 0
+
+
+def _smooth_source(weights, max_loads=None):
+    max_loads = max_loads or {}
+    ops = {}
+    for name in weights:
+        r = client.post(
+            "/operators", json={"name": name, "max_load": max_loads.get(name, 1000)}
+        )
+        ops[name] = r.json()["id"]
+    rs = client.post(
+        "/sources", json={"name": "smooth", "code": "S", "distribution_mode": "smooth"}
+    )
+    source_id = rs.json()["id"]
+    r_cfg = client.put(
+        f"/sources/{source_id}/operators",
+        json=[{"operator_id": ops[name], "weight": w} for name, w in weights.items()],
+    )
+    assert r_cfg.json()["distribution_mode"] == "smooth"
+    names = {op_id: name for name, op_id in ops.items()}
+    return source_id, names
+
+
+def _assign(source_id, names, count, prefix="lead"):
+    result = []
+    for i in range(count):
+        rc = client.post(
+            "/contacts",
+            json={"lead_external_id": f"{prefix}-{i}", "source_id": source_id},
+        )
+        assert rc.status_code == 201
+        op = rc.json()["operator"]
+        result.append(names[op["id"]] if op else None)
+    return result
+
+
+def test_smooth_mode_follows_weights_exactly():
+    source_id, names = _smooth_source({"a": 5, "b": 1, "c": 1})
+
+    picks = _assign(source_id, names, 70)
+    # Последовательность nginx для весов 5/1/1 и точные доли на каждом цикле
+    assert picks[:7] == ["a", "a", "b", "a", "c", "a", "a"]
+    assert picks == picks[:7] * 10
+
+
+def test_smooth_mode_skips_saturated_operator():
+    source_id, names = _smooth_source({"a": 1, "b": 1}, max_loads={"b": 1})
+
+    picks = _assign(source_id, names, 6)
+    assert picks.count("b") == 1
+    assert picks.count("a") == 5
+
+
+def test_smooth_state_survives_restart():
+    source_id, names = _smooth_source({"a": 5, "b": 1, "c": 1})
+    assert _assign(source_id, names, 3) == ["a", "a", "b"]
+
+    assert wrr.state.checkpoint(TestingSessionLocal) == 1
+    # Новый процесс: памяти нет, состояние поднимается из source_wrr_state
+    wrr.state.clear()
+    assert _assign(source_id, names, 4, prefix="after") == ["a", "c", "a", "a"]
@@ -0,0 +1,72 @@
+def test_unchanged_operators_return_304_with_single_version_read(client, statements):
+    client.post("/operators", json={"name": "op1"})
+
+    first = client.get("/operators")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert [op["name"] for op in first.json()] == ["op1"]
+
+    statements.clear()
+    rc = client.get("/operators", headers={"If-None-Match": etag})
+    assert rc.status_code == 304
+    assert rc.headers["ETag"] == etag
+    assert len(statements) == 1
+    assert "data_versions" in statements[0]
+
+    # Без If-None-Match тело берётся из кэша, без запроса к operators
+    statements.clear()
+    rc = client.get("/operators")
+    assert rc.json() == first.json()
+    assert len(statements) == 1
+
+
+def test_unchanged_source_detail_returns_304_with_single_version_read(client, statements):
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+    path = f"/sources/{source['id']}"
+    etag = client.get(path).headers["ETag"]
+
+    statements.clear()
+    rc = client.get(path, headers={"If-None-Match": etag})
+    assert rc.status_code == 304
+    assert len(statements) == 1
+    assert "data_versions" in statements[0]
+
+
+def test_writes_change_etag(client):
+    op = client.post("/operators", json={"name": "op1"}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+
+    etags = {
+        path: client.get(path).headers["ETag"]
+        for path in ("/operators", "/sources", f"/sources/{source['id']}", "/stats/operators")
+    }
+
+    client.put(
+        f"/sources/{source['id']}/operators",
+        json=[{"operator_id": op["id"], "weight": 1}],
+    )
+    detail_path = f"/sources/{source['id']}"
+    rc = client.get(detail_path, headers={"If-None-Match": etags[detail_path]})
+    assert rc.status_code == 200
+    assert rc.json()["operators"][0]["operator_id"] == op["id"]
+    rc = client.get("/operators", headers={"If-None-Match": etags["/operators"]})
+    assert rc.status_code == 304
+
+    client.post("/contacts", json={"lead_external_id": "lead-1", "source_id": source["id"]})
+    rc = client.get("/stats/operators", headers={"If-None-Match": etags["/stats/operators"]})
+    assert rc.status_code == 200
+    assert rc.json()[0]["total_contacts"] == 1
+
+    client.patch(f"/operators/{op['id']}", json={"name": "renamed"})
+    rc = client.get("/operators", headers={"If-None-Match": etags["/operators"]})
+    assert rc.status_code == 200
+    assert rc.json()[0]["name"] == "renamed"
+    assert client.get(detail_path).json()["operators"][0]["operator_name"] == "renamed"
+
+
+def test_missing_source_is_not_cached(client):
+    assert client.get("/sources/1").status_code == 404
+    assert client.get("/sources/1", headers={"If-None-Match": "*"}).status_code == 404
+    client.post("/sources", json={"name": "bot", "code": "bot"})
+    assert client.get("/sources/1").status_code == 200
+    assert client.get("/sources/1", headers={"If-None-Match": "*"}).status_code == 304
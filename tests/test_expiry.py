@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from app import affinity, expiry, models
+from app.background import PeriodicTask
+
+
+@pytest.fixture()
+def app_settings():
+    return {"admin_token": "secret"}
+
+
+def _age(session_factory, contact_ids, minutes):
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=minutes)
+    db = session_factory()
+    try:
+        db.execute(
+            update(models.Contact)
+            .where(models.Contact.id.in_(contact_ids))
+            .values(created_at=created_at)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _setup(client):
+    op = client.post("/operators", json={"name": "op", "max_load": 2}).json()
+    timed = client.post(
+        "/sources", json={"name": "botA", "code": "A", "inactivity_timeout_minutes": 30}
+    ).json()
+    plain = client.post("/sources", json={"name": "botB", "code": "B"}).json()
+    for source in (timed, plain):
+        client.put(
+            f"/sources/{source['id']}/operators",
+            json=[{"operator_id": op["id"], "weight": 1}],
+        )
+    return op["id"], timed["id"], plain["id"]
+
+
+def _contact(client, lead, source_id):
+    return client.post(
+        "/contacts", json={"lead_external_id": lead, "source_id": source_id}
+    ).json()
+
+
+def test_overdue_contacts_expire_and_free_capacity(client, session_factory):
+    op_id, timed, plain = _setup(client)
+    first = _contact(client, "lead-1", timed)
+    second = _contact(client, "lead-2", plain)
+    assert _contact(client, "lead-3", timed)["operator"] is None
+
+    # Оба старые, но таймаут есть только у источника A
+    _age(session_factory, [first["id"], second["id"]], minutes=60)
+
+    headers = {"X-Admin-Token": "secret"}
+    rc = client.post("/admin/expire", headers=headers)
+    assert rc.json() == {"expired": 1}
+    assert client.post("/admin/expire", headers=headers).json() == {"expired": 0}
+
+    assert _contact(client, "lead-4", timed)["operator"]["id"] == op_id
+
+    leads = {lead["external_id"]: lead for lead in client.get("/leads").json()}
+    assert leads["lead-1"]["contacts"][0]["is_active"] is False
+    assert leads["lead-2"]["contacts"][0]["is_active"] is True
+
+
+def test_expiry_runs_in_batches_and_reports_stats(client, session_factory):
+    op = client.post("/operators", json={"name": "op", "max_load": 100}).json()
+    source = client.post(
+        "/sources", json={"name": "bot", "code": "bot", "inactivity_timeout_minutes": 5}
+    ).json()
+    client.put(
+        f"/sources/{source['id']}/operators",
+        json=[{"operator_id": op["id"], "weight": 1}],
+    )
+    ids = [_contact(client, f"lead-{i}", source["id"])["id"] for i in range(7)]
+    _age(session_factory, ids, minutes=10)
+
+    task = PeriodicTask("contacts-expiry", 0, expiry.make_expirer(session_factory, 3))
+    assert task.run_once() == 7
+    stats = task.stats()
+    assert stats["runs"] == 1
+    assert stats["last_result"] == 7
+    assert stats["last_duration"] is not None
+
+    rc = client.get("/admin/tasks", headers={"X-Admin-Token": "secret"})
+    assert "contacts-expiry" in [item["name"] for item in rc.json()]
+
+
+def test_expired_contacts_release_lead_affinity(client, session_factory):
+    op_id, timed, _ = _setup(client)
+    first = _contact(client, "lead-1", timed)
+    _age(session_factory, [first["id"]], minutes=60)
+    lead_id = client.get("/leads").json()[0]["id"]
+
+    db = session_factory()
+    try:
+        assert affinity.cache.get(db, lead_id) == op_id
+        assert client.post("/admin/expire", headers={"X-Admin-Token": "secret"}).json() == {
+            "expired": 1
+        }
+        # У лида нет активных обращений — закрепления за оператором тоже нет
+        assert affinity.cache.get(db, lead_id) is None
+    finally:
+        db.close()
+
+
+def test_timeout_must_be_positive(client):
+    rc = client.post(
+        "/sources", json={"name": "bot", "code": "bot", "inactivity_timeout_minutes": 0}
+    )
+    assert rc.status_code == 422
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+    rc = client.patch(f"/sources/{source['id']}", json={"inactivity_timeout_minutes": -5})
+    assert rc.status_code == 422
+    rc = client.patch(f"/sources/{source['id']}", json={"inactivity_timeout_minutes": None})
+    assert rc.status_code == 200
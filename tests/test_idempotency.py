@@ -0,0 +1,158 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from app import idempotency, models
+from app.main import app, get_idempotency_store
+
+
+@pytest.fixture()
+def client(client):
+    store = idempotency.IdempotencyStore(ttl_seconds=60, cache_size=2)
+    app.dependency_overrides[get_idempotency_store] = lambda: store
+    return client, store
+
+
+def _setup_source(client, max_load=10):
+    op = client.post("/operators", json={"name": "op", "max_load": max_load}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+    client.put(
+        f"/sources/{source['id']}/operators",
+        json=[{"operator_id": op["id"], "weight": 1}],
+    )
+    return source["id"]
+
+
+def test_retry_with_same_key_returns_original_contact(client):
+    client, _ = client
+    source_id = _setup_source(client, max_load=1)
+    body = {"lead_external_id": "lead-1", "source_id": source_id, "message": "hi"}
+    headers = {"Idempotency-Key": "req-1"}
+
+    first = client.post("/contacts", json=body, headers=headers)
+    second = client.post("/contacts", json=body, headers=headers)
+
+    assert first.status_code == 201
+    assert second.status_code == 201
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    # Повтор не занял второй слот оператора
+    assert second.json()["operator"] is not None
+
+    other = client.post("/contacts", json=body, headers={"Idempotency-Key": "req-2"})
+    assert other.json()["id"] != first.json()["id"]
+    assert other.json()["operator"] is None
+
+
+def test_key_found_in_table_after_lru_eviction(client, session_factory):
+    client, store = client
+    source_id = _setup_source(client)
+
+    ids = {}
+    for i in range(4):
+        rc = client.post(
+            "/contacts",
+            json={"lead_external_id": f"lead-{i}", "source_id": source_id},
+            headers={"Idempotency-Key": f"key-{i}"},
+        )
+        ids[i] = rc.json()["id"]
+
+    # LRU держит только 2 ключа, первый берём из таблицы
+    rc = client.post(
+        "/contacts",
+        json={"lead_external_id": "lead-0", "source_id": source_id},
+        headers={"Idempotency-Key": "key-0"},
+    )
+    assert rc.json()["id"] == ids[0]
+
+    db = session_factory()
+    try:
+        assert db.scalar(select(func.count()).select_from(models.Contact)) == 4
+    finally:
+        db.close()
+
+
+def test_purge_expired_in_batches(client, session_factory):
+    client, store = client
+    source_id = _setup_source(client)
+    for i in range(5):
+        client.post(
+            "/contacts",
+            json={"lead_external_id": f"lead-{i}", "source_id": source_id},
+            headers={"Idempotency-Key": f"key-{i}"},
+        )
+
+    db = session_factory()
+    try:
+        # Состариваем три ключа
+        for key in ("key-0", "key-1", "key-2"):
+            row = db.get(models.IdempotencyKey, key)
+            row.expires_at = row.expires_at - timedelta(days=1)
+        db.commit()
+
+        assert store.purge_expired(db, batch_size=2) == 3
+        remaining = db.scalars(select(models.IdempotencyKey.key)).all()
+        assert sorted(remaining) == ["key-3", "key-4"]
+        assert store.lookup(db, "key-0") is None
+    finally:
+        db.close()
+
+
+def test_concurrent_retry_replays_winner(client, session_factory, monkeypatch):
+    client, store = client
+    source_id = _setup_source(client)
+    body = {"lead_external_id": "lead-1", "source_id": source_id}
+    headers = {"Idempotency-Key": "req-1"}
+    first = client.post("/contacts", json=body, headers=headers).json()
+
+    # Второй запрос проверил ключ до commit первого: ни LRU, ни таблица его ещё не видели
+    store._cache.clear()
+    lookup = store.lookup
+    calls = []
+
+    def racing_lookup(db, key):
+        calls.append(key)
+        return None if len(calls) == 1 else lookup(db, key)
+
+    monkeypatch.setattr(store, "lookup", racing_lookup)
+
+    rc = client.post("/contacts", json=body, headers=headers)
+    assert rc.status_code == 201
+    assert rc.headers["Idempotent-Replayed"] == "true"
+    assert rc.json()["id"] == first["id"]
+    assert len(calls) == 2
+
+    db = session_factory()
+    try:
+        assert db.scalar(select(func.count()).select_from(models.Contact)) == 1
+    finally:
+        db.close()
+
+
+def test_expired_key_not_yet_purged_can_be_reused(client, session_factory):
+    client, store = client
+    source_id = _setup_source(client)
+    body = {"lead_external_id": "lead-1", "source_id": source_id}
+    headers = {"Idempotency-Key": "req-1"}
+    first = client.post("/contacts", json=body, headers=headers).json()
+
+    db = session_factory()
+    try:
+        row = db.get(models.IdempotencyKey, "req-1")
+        row.expires_at = row.expires_at - timedelta(days=1)
+        db.commit()
+    finally:
+        db.close()
+    store._cache.clear()
+
+    rc = client.post("/contacts", json=body, headers=headers)
+    assert rc.status_code == 201
+    assert "Idempotent-Replayed" not in rc.headers
+    assert rc.json()["id"] != first["id"]
+
+    db = session_factory()
+    try:
+        assert db.get(models.IdempotencyKey, "req-1").contact_id == rc.json()["id"]
+    finally:
+        db.close()
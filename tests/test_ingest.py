@@ -0,0 +1,140 @@
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import create_engine, update
+
+from app import idempotency, ingest, models
+from app.database import Base
+from app.main import app, get_idempotency_store, get_ingest_queue
+
+
+@pytest.fixture()
+def db_engine(tmp_path):
+    # Писатель работает в отдельном потоке, поэтому берём файловую базу
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'ingest.db'}",
+        connect_args={"check_same_thread": False},
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture()
+def app_settings():
+    return {"ingest_async": True, "ingest_max_wait_ms": 2000}
+
+
+@pytest.fixture()
+def async_client(client, session_factory):
+    store = idempotency.IdempotencyStore(ttl_seconds=60)
+    queue = ingest.IngestQueue(
+        session_factory, maxsize=100, batch_size=10, batch_wait_ms=5, idempotency=store
+    )
+    app.dependency_overrides[get_ingest_queue] = lambda: queue
+    app.dependency_overrides[get_idempotency_store] = lambda: store
+    yield client, queue
+    queue.stop()
+
+
+def _setup_source(client):
+    op = client.post("/operators", json={"name": "op", "max_load": 100}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+    client.put(
+        f"/sources/{source['id']}/operators",
+        json=[{"operator_id": op["id"], "weight": 1}],
+    )
+    return source["id"], op["id"]
+
+
+def test_async_contact_waits_for_result(async_client):
+    client, _ = async_client
+    source_id, op_id = _setup_source(client)
+
+    rc = client.post(
+        "/contacts?wait_ms=2000",
+        json={"lead_external_id": "lead-1", "source_id": source_id},
+    )
+    assert rc.status_code == 201
+    payload = rc.json()
+    assert payload["lead"]["external_id"] == "lead-1"
+    assert payload["operator"]["id"] == op_id
+
+
+def test_async_contact_ticket_polling(async_client):
+    client, _ = async_client
+    source_id, _ = _setup_source(client)
+
+    tickets = []
+    for i in range(20):
+        rc = client.post(
+            "/contacts",
+            json={"lead_external_id": f"lead-{i % 5}", "source_id": source_id},
+        )
+        assert rc.status_code == 202
+        tickets.append(rc.json()["ticket_id"])
+
+    deadline = time.monotonic() + 5
+    statuses = {}
+    while time.monotonic() < deadline:
+        statuses = {
+            t: client.get(f"/contacts/tickets/{t}").json()["status"] for t in tickets
+        }
+        if all(s == ingest.TICKET_DONE for s in statuses.values()):
+            break
+        time.sleep(0.02)
+    assert all(s == ingest.TICKET_DONE for s in statuses.values())
+
+    # Повторные обращения одного лида не плодят лидов
+    leads = client.get("/leads").json()
+    assert len(leads) == 5
+    assert sum(len(lead["contacts"]) for lead in leads) == 20
+
+
+def test_async_queue_full_returns_429(async_client):
+    client, queue = async_client
+    source_id, _ = _setup_source(client)
+
+    # Очередь без писателя и с одним местом
+    full_queue = ingest.IngestQueue(queue.session_factory, maxsize=1)
+    full_queue.start = lambda: None
+    app.dependency_overrides[get_ingest_queue] = lambda: full_queue
+
+    body = {"lead_external_id": "lead-x", "source_id": source_id}
+    assert client.post("/contacts", json=body).status_code == 202
+    rc = client.post("/contacts", json=body)
+    assert rc.status_code == 429
+    assert rc.headers["Retry-After"] == "1"
+
+
+def test_async_expired_key_does_not_fail_ticket(async_client):
+    client, queue = async_client
+    source_id, _ = _setup_source(client)
+    headers = {"Idempotency-Key": "req-1"}
+    body = {"lead_external_id": "lead-1", "source_id": source_id}
+    first = client.post("/contacts?wait_ms=2000", json=body, headers=headers).json()
+
+    # Ключ просрочен, но фоновая очистка до него ещё не дошла
+    db = queue.session_factory()
+    try:
+        db.execute(
+            update(models.IdempotencyKey).values(
+                expires_at=models.IdempotencyKey.expires_at - timedelta(days=1)
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+    queue.idempotency._cache.clear()
+
+    rc = client.post("/contacts", json=body, headers=headers)
+    assert rc.status_code == 202
+    ticket_id = rc.json()["ticket_id"]
+    deadline = time.monotonic() + 5
+    ticket = client.get(f"/contacts/tickets/{ticket_id}").json()
+    while ticket["status"] == ingest.TICKET_PENDING and time.monotonic() < deadline:
+        time.sleep(0.02)
+        ticket = client.get(f"/contacts/tickets/{ticket_id}").json()
+    assert ticket["status"] == ingest.TICKET_DONE, ticket
+    assert ticket["contact"]["id"] != first["id"]
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import json
+
+import httpx
+
+from app.main import app
+from benchmarks import loadgen
+
+
+def test_synthetic_load_and_spread_report(client, capsys):
+    source_ids = loadgen.setup_instance(client, sources=2, operators=2)
+    before = loadgen.operator_counts(client)
+    plan = list(
+        loadgen.synthetic(
+            source_ids,
+            rate=1000,
+            duration=0.05,
+            repeat_ratio=0.3,
+            read_ratio=0.2,
+            skew=1.1,
+            seed=1,
+        )
+    )
+    assert {item.kind for item in plan} >= {"POST /contacts"}
+
+    # Одна конкурентная заявка: тестовая база — одно соединение на всех
+    results, elapsed = asyncio.run(
+        loadgen.drive(
+            "http://loadgen",
+            iter(plan),
+            concurrency=1,
+            timeout=5,
+            transport=httpx.ASGITransport(app=app),
+        )
+    )
+    assert len(results) == len(plan)
+    assert all(result.status in (200, 201, 304) for result in results)
+
+    loadgen.report(results, elapsed)
+    after = loadgen.operator_counts(client)
+    loadgen.report_spread(before, after, loadgen.source_weights(client, source_ids))
+    out = capsys.readouterr().out
+    assert f"запросов: {len(plan)}" in out
+    assert "ошибки: 0 (0.0%)" in out
+    assert f"источник {source_ids[0]}" in out
+
+
+def test_replay_reads_recorded_plan():
+    plan = [
+        loadgen.Planned(0.5, "POST", "/contacts", json={"lead_external_id": "a", "source_id": 1}),
+        loadgen.Planned(1.0, "GET", "/sources", headers={"X-Test": "1"}),
+    ]
+    stream = io.StringIO("".join(f"{json.dumps(p.to_record())}\n" for p in plan))
+    assert list(loadgen.replay(stream, rate=10, speed=2)) == [
+        loadgen.Planned(0.25, "POST", "/contacts", json={"lead_external_id": "a", "source_id": 1}),
+        loadgen.Planned(0.5, "GET", "/sources", headers={"X-Test": "1"}),
+    ]
+
+    # Без меток времени — равномерно с частотой rate
+    stream = io.StringIO('{"path": "/sources"}\n\n{"path": "/leads"}\n')
+    assert [p.t for p in loadgen.replay(stream, rate=10, speed=1)] == [0.0, 0.2]
+
+
+def test_report_spread_compares_shares_with_weights(capsys):
+    before = {(1, 10): 5}
+    after = {(1, 10): 30, (1, 20): 75}
+    loadgen.report_spread(before, after, {1: {10: 1, 20: 3}, 2: {10: 1}})
+    out = capsys.readouterr().out
+    assert "источник 1 (100): op10 25.0%/25.0%, op20 75.0%/75.0%; макс. отклонение 0.0%" in out
+    # Источник без новых обращений не печатается
+    assert "источник 2" not in out
@@ -0,0 +1,118 @@
+import pstats
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from app import profiling
+from app.main import app, get_profile_store
+
+
+engine = create_engine(
+    "sqlite:///:memory:",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+
+
+def _make_app(store, sample_rate=0.0):
+    demo = FastAPI()
+    profiling.install(demo, store, sample_rate=sample_rate, admin_token="secret")
+
+    @demo.get("/work")
+    def work():
+        with engine.connect() as conn:
+            value = conn.execute(text("SELECT 41 + 1")).scalar()
+        return {"value": sum(range(1000)) + value}
+
+    return demo
+
+
+@pytest.fixture()
+def app_settings():
+    return {"admin_token": "secret"}
+
+
+@pytest.fixture()
+def store(tmp_path):
+    return profiling.ProfileStore(str(tmp_path / "profiles"), keep=3)
+
+
+def test_profile_only_on_admin_header(store):
+    client = TestClient(_make_app(store))
+
+    assert client.get("/work").status_code == 200
+    assert client.get("/work", headers={"X-Profile": "1"}).status_code == 200
+    assert store.list() == []
+
+    rc = client.get("/work", headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    assert rc.status_code == 200
+    profiles = store.list()
+    assert len(profiles) == 1
+    info = profiles[0]
+    assert info["path"] == "/work"
+    assert info["status"] == 200
+    assert info["sql_count"] == 1
+
+    detail = store.get(info["id"])
+    assert detail["sql"][0]["statement"] == "SELECT 41 + 1"
+    assert "work" in detail["summary"]
+    stats = pstats.Stats(str(store.prof_path(info["id"])))
+    assert stats.total_calls > 0
+
+
+def test_ring_buffer_keeps_last_profiles(store):
+    client = TestClient(_make_app(store, sample_rate=1.0))
+    for _ in range(5):
+        client.get("/work")
+    assert len(store.list()) == 3
+    assert len(list(store.directory.glob("*.prof"))) == 3
+
+
+def test_admin_endpoints_list_and_download(store, client):
+    TestClient(_make_app(store, sample_rate=1.0)).get("/work")
+    profile_id = store.list()[0]["id"]
+
+    app.dependency_overrides[get_profile_store] = lambda: store
+    headers = {"X-Admin-Token": "secret"}
+    assert client.get("/admin/profiles").status_code == 403
+
+    listed = client.get("/admin/profiles", headers=headers).json()
+    assert [p["id"] for p in listed] == [profile_id]
+
+    detail = client.get(f"/admin/profiles/{profile_id}", headers=headers).json()
+    assert detail["sql_count"] == 1
+
+    rc = client.get(f"/admin/profiles/{profile_id}/download", headers=headers)
+    assert rc.status_code == 200
+    assert rc.content == store.prof_path(profile_id).read_bytes()
+
+    assert client.get("/admin/profiles/..%2Fapp/download", headers=headers).status_code == 404
+
+
+def test_overlapping_profiled_requests_do_not_fail(store):
+    # Оба запроса одновременно внутри эндпоинта: cProfile достаётся только одному
+    inside = threading.Barrier(2, timeout=5)
+    demo = FastAPI()
+    profiling.install(demo, store, sample_rate=1.0, admin_token="secret")
+
+    @demo.get("/slow")
+    def slow():
+        inside.wait()
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return {"ok": True}
+
+    client = TestClient(demo)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        statuses = list(pool.map(lambda _: client.get("/slow").status_code, range(2)))
+    assert statuses == [200, 200]
+
+    profiles = store.list()
+    assert len(profiles) == 2
+    assert all(p["sql_count"] == 1 for p in profiles)
+    assert len(list(store.directory.glob("*.prof"))) == 1
@@ -0,0 +1,98 @@
+from collections import Counter
+
+import pytest
+
+from app import affinity, models, versions
+
+
+def _active_loads(session_factory):
+    db = session_factory()
+    try:
+        rows = db.query(models.Contact.operator_id).filter(models.Contact.is_active.is_(True))
+        return Counter(op_id for (op_id,) in rows)
+    finally:
+        db.close()
+
+
+def _setup(client, session_factory, count, op3_load=10):
+    ops = [
+        client.post("/operators", json={"name": "op1", "max_load": 100}).json()["id"],
+        client.post("/operators", json={"name": "op2", "max_load": 10}).json()["id"],
+        client.post("/operators", json={"name": "op3", "max_load": op3_load}).json()["id"],
+    ]
+    source_id = client.post("/sources", json={"name": "bot", "code": "bot"}).json()["id"]
+    client.put(
+        f"/sources/{source_id}/operators",
+        json=[
+            {"operator_id": ops[0], "weight": 1},
+            {"operator_id": ops[1], "weight": 1},
+            {"operator_id": ops[2], "weight": 2},
+        ],
+    )
+
+    # Пока op2 и op3 выключены, всё уходит к op1
+    for op_id in ops[1:]:
+        client.patch(f"/operators/{op_id}", json={"active": False})
+    for i in range(count):
+        client.post("/contacts", json={"lead_external_id": f"lead-{i}", "source_id": source_id})
+    for op_id in ops[1:]:
+        client.patch(f"/operators/{op_id}", json={"active": True})
+    assert _active_loads(session_factory) == {ops[0]: count}
+    return ops
+
+
+def test_deactivation_moves_all_active_contacts_by_weight(client, session_factory):
+    op1, op2, op3 = _setup(client, session_factory, 6)
+
+    rc = client.patch(f"/operators/{op1}", json={"active": False})
+    assert rc.status_code == 200
+    assert rc.headers["X-Rebalanced-Contacts"] == "6"
+    assert _active_loads(session_factory) == {op2: 2, op3: 4}
+
+
+def test_lowered_max_load_moves_only_surplus(client, session_factory):
+    op1, op2, op3 = _setup(client, session_factory, 6)
+
+    rc = client.patch(f"/operators/{op1}", json={"max_load": 3})
+    assert rc.headers["X-Rebalanced-Contacts"] == "3"
+    assert _active_loads(session_factory) == {op1: 3, op2: 1, op3: 2}
+
+
+def test_drain_respects_limits_and_reports_unplaced(client, session_factory):
+    op1, op2, op3 = _setup(client, session_factory, 15, op3_load=2)
+
+    # Отключаем без автоматического перераспределения через прямую правку в базе
+    db = session_factory()
+    db.get(models.Operator, op1).active = False
+    db.commit()
+    db.close()
+
+    rc = client.post(f"/operators/{op1}/drain")
+    assert rc.status_code == 200
+    assert rc.json() == {"operator_id": op1, "moved": 12, "unplaced": 3}
+    assert _active_loads(session_factory) == {op1: 3, op2: 10, op3: 2}
+
+    assert client.post("/operators/999/drain").status_code == 404
+
+
+def test_affinity_follows_rebalance_only_after_commit(client, session_factory, monkeypatch):
+    op1, op2, op3 = _setup(client, session_factory, 6)
+    db = session_factory()
+    db.get(models.Operator, op1).active = False
+    db.commit()
+    db.close()
+    assert set(affinity.cache._data.values()) == {op1}
+
+    # Перераспределение посчитано, но commit не состоялся
+    def broken_bump(db, entity):
+        raise RuntimeError("commit failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(versions, "bump", broken_bump)
+        with pytest.raises(RuntimeError):
+            client.post(f"/operators/{op1}/drain")
+    assert set(affinity.cache._data.values()) == {op1}
+    assert _active_loads(session_factory) == {op1: 6}
+
+    assert client.post(f"/operators/{op1}/drain").json()["moved"] == 6
+    assert set(affinity.cache._data.values()) == {op2, op3}
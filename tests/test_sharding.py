@@ -0,0 +1,253 @@
+import csv
+import io
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import affinity, idempotency, services, sharding, startup
+from app.database import Base
+from app.settings import settings
+
+
+@pytest.fixture()
+def db_engine(tmp_path):
+    # ATTACH видит только файлы, поэтому и глобальная база здесь файловая
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'global.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture()
+def app_settings():
+    return {"admin_token": "secret"}
+
+
+@pytest.fixture()
+def sharded(client, tmp_path, monkeypatch):
+    global_path = tmp_path / "global.db"
+    shard_paths = [tmp_path / f"shard{i}.db" for i in range(2)]
+    router = sharding.ShardRouter(
+        [f"sqlite:///{path}" for path in shard_paths], f"sqlite:///{global_path}"
+    )
+    router.create_schema()
+    monkeypatch.setattr(sharding, "router", router)
+
+    yield client, global_path, shard_paths
+
+    router.dispose()
+
+
+def _count(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _setup(client, max_load=10):
+    op = client.post("/operators", json={"name": "op", "max_load": max_load}).json()
+    sources = []
+    for code in ("A", "B"):
+        source = client.post("/sources", json={"name": f"bot{code}", "code": code}).json()
+        client.put(
+            f"/sources/{source['id']}/operators",
+            json=[{"operator_id": op["id"], "weight": 1}],
+        )
+        sources.append(source["id"])
+    return op["id"], sources
+
+
+def _post(client, lead, source_id, **kwargs):
+    return client.post(
+        "/contacts", json={"lead_external_id": lead, "source_id": source_id}, **kwargs
+    )
+
+
+def test_contacts_land_in_source_shard(sharded):
+    client, global_path, shard_paths = sharded
+    op_id, (src_a, src_b) = _setup(client)
+
+    a = _post(client, "lead-1", src_a).json()
+    b = _post(client, "lead-1", src_b).json()
+    assert a["id"] % 2 == src_a % 2
+    assert b["id"] % 2 == src_b % 2
+    assert a["lead"]["id"] == b["lead"]["id"]
+    assert a["operator"]["id"] == op_id
+
+    assert _count(global_path, "contacts") == 0
+    assert _count(global_path, "leads") == 1
+    assert [_count(path, "contacts") for path in shard_paths] == [1, 1]
+
+    # GET /leads собирает обращения лида из обоих шардов
+    leads = client.get("/leads").json()
+    assert sorted(c["id"] for c in leads[0]["contacts"]) == sorted([a["id"], b["id"]])
+
+    sparse = client.get("/leads?fields=contacts.source_id&include=contacts.source").json()
+    assert sorted(c["source_id"] for c in sparse[0]["contacts"]) == [src_a, src_b]
+    assert {c["source"]["code"] for c in sparse[0]["contacts"]} == {"A", "B"}
+
+
+def test_operator_limit_counts_all_shards(sharded):
+    client, _, _ = sharded
+    op_id, (src_a, src_b) = _setup(client, max_load=3)
+
+    assigned = [
+        _post(client, f"lead-{i}", (src_a, src_b)[i % 2]).json()["operator"]
+        for i in range(6)
+    ]
+    assert sum(1 for op in assigned if op is not None) == 3
+
+    stats = client.get("/stats/operators").json()
+    assert stats[0]["total_contacts"] == 3
+    assert {s["source_id"] for s in stats[0]["sources"]} == {src_a, src_b}
+
+    only_a = client.get(f"/stats/operators?source_id={src_a}").json()
+    assert [s["source_id"] for s in only_a[0]["sources"]] == [src_a]
+
+
+def test_export_and_idempotency_route_to_shard(sharded):
+    client, _, _ = sharded
+    _, (src_a, src_b) = _setup(client)
+    headers = {"Idempotency-Key": "req-1"}
+    first = _post(client, "lead-1", src_a, headers=headers)
+    replay = _post(client, "lead-1", src_a, headers=headers)
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json()["id"] == first.json()["id"]
+    _post(client, "lead-2", src_b)
+
+    rows = list(csv.DictReader(io.StringIO(client.get("/contacts/export").text)))
+    assert sorted(row["lead_external_id"] for row in rows) == ["lead-1", "lead-2"]
+
+    rows = list(
+        csv.DictReader(io.StringIO(client.get(f"/contacts/export?source_id={src_b}").text))
+    )
+    assert [row["lead_external_id"] for row in rows] == ["lead-2"]
+
+    assert client.post("/admin/expire", headers={"X-Admin-Token": "secret"}).json() == {
+        "expired": 0
+    }
+
+
+def test_rebalance_moves_contacts_in_all_shards(sharded):
+    client, _, shard_paths = sharded
+    op1, (src_a, src_b) = _setup(client)
+    for i in range(4):
+        _post(client, f"lead-{i}", (src_a, src_b)[i % 2])
+
+    op2 = client.post("/operators", json={"name": "op2", "max_load": 10}).json()["id"]
+    for source_id in (src_a, src_b):
+        client.put(
+            f"/sources/{source_id}/operators",
+            json=[{"operator_id": op1, "weight": 1}, {"operator_id": op2, "weight": 1}],
+        )
+
+    rc = client.patch(f"/operators/{op1}", json={"max_load": 1})
+    assert rc.headers["X-Rebalanced-Contacts"] == "3"
+
+    drained = client.patch(f"/operators/{op1}", json={"active": False})
+    assert drained.headers["X-Rebalanced-Contacts"] == "1"
+
+    stats = {item["operator_id"]: item for item in client.get("/stats/operators").json()}
+    assert stats[op2]["total_contacts"] == 4
+    assert op1 not in stats
+    assert client.post(f"/operators/{op1}/drain").json()["moved"] == 0
+
+
+def test_unique_leads_sketches_live_in_shards(sharded):
+    client, global_path, shard_paths = sharded
+    _, (src_a, src_b) = _setup(client)
+    for i in range(3):
+        _post(client, f"lead-{i}", src_a)
+    _post(client, "lead-0", src_b)
+
+    assert _count(global_path, "lead_sketches") == 0
+    assert [_count(path, "lead_sketches") for path in shard_paths] == [1, 1]
+
+    total = client.get("/stats/unique-leads?group_by=total").json()
+    assert total == [{"unique_leads": 3}]
+    only_b = client.get(f"/stats/unique-leads?group_by=source&source_id={src_b}").json()
+    assert only_b == [{"source_id": src_b, "unique_leads": 1}]
+
+    headers = {"X-Admin-Token": "secret"}
+    assert client.post("/admin/unique-leads/rebuild", headers=headers).json() == {
+        "contacts": 4
+    }
+    assert client.get("/stats/unique-leads?group_by=total").json() == total
+
+
+def test_contact_ids_are_not_reused_after_archiving(sharded, monkeypatch):
+    client, global_path, shard_paths = sharded
+    _, (src_a, _) = _setup(client)
+    first = _post(client, "lead-1", src_a).json()["id"]
+
+    conn = sqlite3.connect(shard_paths[src_a % 2])
+    try:
+        conn.execute(
+            "UPDATE contacts SET is_active = 0, created_at = '2000-01-01 00:00:00'"
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    monkeypatch.setattr(settings, "archive_retention_days", 30)
+    headers = {"X-Admin-Token": "secret"}
+    assert client.post("/admin/archive", headers=headers).json() == {"archived": 1}
+
+    second = _post(client, "lead-1", src_a).json()["id"]
+    assert second == first + 2
+
+
+def test_warm_up_reads_recent_leads_and_keys_from_shards(sharded, session_factory):
+    client, _, _ = sharded
+    op_id, (src_a, src_b) = _setup(client)
+    _post(client, "lead-1", src_a, headers={"Idempotency-Key": "key-a"})
+    _post(client, "lead-2", src_b, headers={"Idempotency-Key": "key-b"})
+
+    affinity.cache.clear()
+    store = idempotency.IdempotencyStore(ttl_seconds=60)
+    db = session_factory()
+    try:
+        warmup = startup.warm_up(db, store)
+    finally:
+        db.close()
+
+    assert warmup["leads"] == 2
+    assert warmup["idempotency_keys"] == 2
+    assert store.cached("key-a") is not None and store.cached("key-b") is not None
+    assert affinity.cache._data == {1: op_id, 2: op_id}
+
+
+def test_rebalance_reports_shard_that_failed_to_commit(sharded, monkeypatch):
+    client, _, shard_paths = sharded
+    op1, (src_a, src_b) = _setup(client)
+    for i in range(4):
+        _post(client, f"lead-{i}", (src_a, src_b)[i % 2])
+    op2 = client.post("/operators", json={"name": "op2", "max_load": 10}).json()["id"]
+    for source_id in (src_a, src_b):
+        client.put(
+            f"/sources/{source_id}/operators",
+            json=[{"operator_id": op1, "weight": 1}, {"operator_id": op2, "weight": 1}],
+        )
+
+    apply = services._apply_assignments
+
+    def failing_in_second_shard(db, assignments):
+        if str(shard_paths[1]) in str(db.get_bind().url):
+            raise RuntimeError("shard is locked")
+        apply(db, assignments)
+
+    monkeypatch.setattr(services, "_apply_assignments", failing_in_second_shard)
+    rc = client.patch(f"/operators/{op1}", json={"active": False})
+    assert rc.status_code == 200
+    assert rc.headers["X-Rebalanced-Contacts"] == "2"
+    rc = client.post(f"/operators/{op1}/drain")
+    assert rc.json() == {"operator_id": op1, "moved": 0, "unplaced": 2}
+
+    # Обращения упавшего шарда остались у оператора, остальные ушли к op2
+    stats = {item["operator_id"]: item for item in client.get("/stats/operators").json()}
+    assert stats[op1]["total_contacts"] == 2
+    assert stats[op2]["total_contacts"] == 2
@@ -0,0 +1,85 @@
+import pytest
+
+
+@pytest.fixture()
+def client(client):
+    op = client.post("/operators", json={"name": "op", "max_load": 100}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "B"}).json()
+    client.put(
+        f"/sources/{source['id']}/operators", json=[{"operator_id": op["id"], "weight": 1}]
+    )
+    for i in range(3):
+        client.post(
+            "/contacts",
+            json={
+                "lead_external_id": f"lead-{i}",
+                "lead_name": f"Lead {i}",
+                "source_id": source["id"],
+                "message": "x" * 2000,
+            },
+        )
+    return client
+
+
+def test_leads_fields_select_only_requested_columns(client, statements):
+    response = client.get("/leads?fields=external_id,contacts.is_active")
+    assert response.status_code == 200
+    leads = response.json()
+    assert leads[0] == {
+        "id": 1,
+        "external_id": "lead-0",
+        "contacts": [{"id": 1, "is_active": True}],
+    }
+
+    # message и вложенные объекты не читаются вовсе
+    assert not any("message" in sql for sql in statements)
+    assert not any("FROM sources" in sql or "FROM operators" in sql for sql in statements)
+
+
+def test_leads_include_nested_objects_on_request(client, statements):
+    leads = client.get("/leads?fields=contacts.id&include=contacts.operator").json()
+    contact = leads[0]["contacts"][0]
+    assert contact == {
+        "id": 1,
+        "operator": {"id": 1, "name": "op", "active": True, "max_load": 100},
+    }
+
+    # include без contacts.* в fields — только id обращения, без message
+    statements.clear()
+    leads = client.get("/leads?include=contacts.operator").json()
+    assert leads[0]["contacts"][0] == contact
+    assert not any("message" in sql for sql in statements)
+    assert client.get("/leads?include=contacts").json()[0]["contacts"][0] == {"id": 1}
+
+    # Без упоминания обращений в fields/include их нет в ответе
+    assert client.get("/leads?fields=name").json()[0] == {"id": 1, "name": "Lead 0"}
+
+    # Без параметров — прежний полный ответ
+    full = client.get("/leads").json()[0]["contacts"][0]
+    assert full["source"]["name"] == "bot" and full["message"] == "x" * 2000
+
+
+def test_unknown_field_is_rejected(client):
+    response = client.get("/leads?fields=external_id,password")
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+    assert client.get("/leads?include=contacts.lead").status_code == 400
+
+
+def test_operators_fields_and_etag(client):
+    full = client.get("/operators")
+    sparse = client.get("/operators?fields=name")
+    assert sparse.json() == [{"id": 1, "name": "op"}]
+    assert sparse.headers["ETag"] != full.headers["ETag"]
+
+    again = client.get("/operators?fields=name", headers={"If-None-Match": sparse.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_large_responses_are_gzipped(client):
+    response = client.get("/leads", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()) == 3
+
+    small = client.get("/leads?fields=id", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
@@ -0,0 +1,62 @@
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine
+
+from app import affinity, idempotency, startup
+from app.main import app, get_readiness
+
+
+@pytest.fixture()
+def client(client):
+    readiness = startup.Readiness()
+    app.dependency_overrides[get_readiness] = lambda: readiness
+    return client, readiness
+
+
+def test_check_schema_requires_alembic_head(tmp_path):
+    url = f"sqlite:///{tmp_path / 'schema.db'}"
+    db_engine = create_engine(url)
+    with pytest.raises(startup.SchemaOutdated):
+        startup.check_schema(db_engine)
+
+    # Без файла конфигурации env.py не трогает настройки логирования
+    config = Config()
+    config.set_main_option("script_location", str(startup.ALEMBIC_INI.parent / "alembic"))
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "head")
+
+    assert startup.check_schema(db_engine)
+    db_engine.dispose()
+
+
+def test_ready_only_after_warm_up(client, session_factory):
+    client, readiness = client
+    op = client.post("/operators", json={"name": "op", "max_load": 10}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+    client.put(
+        f"/sources/{source['id']}/operators",
+        json=[{"operator_id": op["id"], "weight": 1}],
+    )
+    for i in range(3):
+        client.post(
+            "/contacts",
+            json={"lead_external_id": f"lead-{i}", "source_id": source["id"]},
+            headers={"Idempotency-Key": f"key-{i}"},
+        )
+
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/health/ready").status_code == 503
+
+    affinity.cache.clear()
+    store = idempotency.IdempotencyStore(ttl_seconds=60, cache_size=2)
+    readiness.run_warm_up(session_factory, store, leads_limit=100)
+
+    rc = client.get("/health/ready")
+    assert rc.status_code == 200
+    assert rc.json()["warmup"] == {"sources": 1, "leads": 3, "idempotency_keys": 2}
+    assert len(affinity.cache._data) == 3
+    assert set(store._cache) == {"key-1", "key-2"}
+
+    readiness.mark_not_ready("shutdown")
+    assert client.get("/health/ready").status_code == 503
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+
+from app import hll, models
+
+
+def test_hll_estimate_within_few_percent():
+    sketch = hll.HyperLogLog()
+    for i in range(50000):
+        sketch.add(i)
+    assert abs(sketch.count() - 50000) / 50000 < 0.04
+
+    small = hll.HyperLogLog()
+    for i in range(100):
+        small.add(i)
+        small.add(i)
+    assert abs(small.count() - 100) <= 3
+
+
+def test_hll_merge_equals_union():
+    left, right, union = hll.HyperLogLog(), hll.HyperLogLog(), hll.HyperLogLog()
+    for i in range(3000):
+        left.add(i)
+        union.add(i)
+    for i in range(2000, 6000):
+        right.add(i)
+        union.add(i)
+
+    merged = hll.HyperLogLog.from_bytes(left.to_bytes()).merge(right)
+    assert merged.registers == union.registers
+    assert abs(merged.count() - 6000) / 6000 < 0.04
+
+
+def test_unique_leads_endpoint(client, session_factory):
+    op1 = client.post("/operators", json={"name": "op1", "max_load": 1000}).json()
+    op2 = client.post("/operators", json={"name": "op2", "max_load": 1000}).json()
+    src_a = client.post("/sources", json={"name": "botA", "code": "A"}).json()
+    src_b = client.post("/sources", json={"name": "botB", "code": "B"}).json()
+    client.put(
+        f"/sources/{src_a['id']}/operators",
+        json=[{"operator_id": op1["id"], "weight": 1}],
+    )
+    client.put(
+        f"/sources/{src_b['id']}/operators",
+        json=[{"operator_id": op2["id"], "weight": 1}],
+    )
+
+    # 30 лидов пишут в A по два раза, лиды 20..49 — ещё и в B
+    for i in range(30):
+        for _ in range(2):
+            client.post(
+                "/contacts",
+                json={"lead_external_id": f"lead-{i}", "source_id": src_a["id"]},
+            )
+    for i in range(20, 50):
+        client.post(
+            "/contacts",
+            json={"lead_external_id": f"lead-{i}", "source_id": src_b["id"]},
+        )
+
+    rows = client.get("/stats/unique-leads?group_by=source_operator").json()
+    assert rows == [
+        {"source_id": src_a["id"], "operator_id": op1["id"], "unique_leads": 30},
+        {"source_id": src_b["id"], "operator_id": op2["id"], "unique_leads": 30},
+    ]
+
+    total = client.get("/stats/unique-leads?group_by=total").json()
+    assert total == [{"unique_leads": 50}]
+
+    tomorrow = (datetime.now(timezone.utc).date() + timedelta(days=1)).isoformat()
+    assert client.get(f"/stats/unique-leads?date_from={tomorrow}").json() == []
+
+    db = session_factory()
+    try:
+        # Один скетч на (источник, оператор, день), а не на обращение
+        assert db.query(models.LeadSketch).count() == 2
+        assert hll.rebuild_sketches(db) == 90
+    finally:
+        db.close()
+    assert client.get("/stats/unique-leads?group_by=source_operator").json() == rows
+
+
+def test_unique_leads_rows_carry_only_grouped_fields(client):
+    op = client.post("/operators", json={"name": "op", "max_load": 2}).json()
+    source = client.post("/sources", json={"name": "bot", "code": "bot"}).json()
+    client.put(
+        f"/sources/{source['id']}/operators",
+        json=[{"operator_id": op["id"], "weight": 1}],
+    )
+    # Двум лидам достаётся оператор, ещё трём — нет (лимит)
+    for i in range(5):
+        client.post(
+            "/contacts", json={"lead_external_id": f"lead-{i}", "source_id": source["id"]}
+        )
+
+    rows = client.get("/stats/unique-leads?group_by=operator").json()
+    assert rows == [
+        {"operator_id": op["id"], "unique_leads": 2},
+        {"operator_id": None, "unique_leads": 3},
+    ]
+    rows = client.get("/stats/unique-leads?group_by=source_operator").json()
+    assert rows == [
+        {"source_id": source["id"], "operator_id": op["id"], "unique_leads": 2},
+        {"source_id": source["id"], "operator_id": None, "unique_leads": 3},
+    ]
+    assert client.get("/stats/unique-leads?group_by=source").json() == [
+        {"source_id": source["id"], "unique_leads": 5}
+    ]